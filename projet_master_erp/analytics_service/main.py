@@ -1,11 +1,34 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+import io
+import numpy as np
+import orjson
 import pandas as pd
-from sqlalchemy import create_engine
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+import json
 import os
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
 from statsmodels.tsa.arima.model import ARIMA
-from datetime import timedelta
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from typing import List, Literal, Optional
+import atexit
+import fcntl
+import hashlib
+import multiprocessing
+import pickle
+import queue
+import signal
+import threading
+import time
+import uuid
 import warnings
 
 warnings.filterwarnings('ignore')
@@ -15,25 +38,385 @@ DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://admin:password@db/bi_ware
 
 app = FastAPI(title="Analytics Service (Distribution)", version="3.0")
 
+# Snapshot Parquet écrit par l'ETL (même SNAPSHOT_DIR) : les calculs lisent les marts et dimensions
+# exportés plutôt que le PostgreSQL partagé (les partitions de fact_ventes restent disponibles pour
+# les traitements au niveau ligne). Sans manifeste, repli automatique sur le Data Warehouse.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "")
+
+# Pool de connexions (par processus) et garde-fous, mêmes variables que l'ERP
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+_bi_engine = None
+_bi_engine_lock = threading.Lock()
+
 def get_bi_engine():
-    return create_engine(DATABASE_URL)
+    """Moteur unique du processus, créé au premier appel (les processus de calcul « spawn » ont le leur)"""
+    global _bi_engine
+    with _bi_engine_lock:
+        if _bi_engine is None:
+            options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW,
+                       "pool_timeout": DB_POOL_TIMEOUT, "pool_recycle": DB_POOL_RECYCLE}
+            if DB_STATEMENT_TIMEOUT_MS:
+                options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+            _bi_engine = create_engine(DATABASE_URL, **options)
+        return _bi_engine
 
-# --- 1. DATA MINING : SEGMENTATION RFM (K-MEANS) ---
-@app.get("/mining/rfm")
-def get_rfm_segmentation():
-    engine = get_bi_engine()
+def read_manifest():
+    if not SNAPSHOT_DIR:
+        return None
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def read_snapshot(manifest, table, columns):
+    """Lecture mmap, limitée aux colonnes demandées, des seuls fichiers listés dans le manifeste"""
+    if table == 'fact_ventes':
+        entries = [manifest["partitions"][month] for month in sorted(manifest["partitions"])]
+    elif table.startswith('mart_'):
+        entries = [manifest["marts"][table]]
+    else:
+        entries = [manifest["dimensions"][table]]
+    tables = [pq.read_table(os.path.join(SNAPSHOT_DIR, e["file"]), columns=columns, memory_map=True) for e in entries]
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    return pa.concat_tables(tables).to_pandas()
+
+def snapshot_marts():
+    """Manifeste utilisable pour les agrégats : None si le snapshot n'exporte pas encore les marts"""
+    manifest = read_manifest()
+    return manifest if manifest and "marts" in manifest else None
+
+def load_rfm_base():
+    """Récence / fréquence / montant par client, depuis le mart exporté dans le snapshot ou le Data Warehouse"""
+    manifest = snapshot_marts()
+    if manifest:
+        # Mart déjà agrégé par client_id (entier) par l'ETL : les homonymes restent des clients distincts
+        rfm = read_snapshot(manifest, 'mart_client_rfm', ['client_id', 'last_order_date', 'frequence', 'montant_total'])
+        clients = read_snapshot(manifest, 'dim_client', ['client_id', 'client_name'])
+        return rfm.merge(clients, on='client_id', how='left')[
+            ['client_id', 'client_name', 'last_order_date', 'frequence', 'montant_total']]
+    # Agrégats par client maintenus par l'ETL (mart_client_rfm) : pas de parcours de fact_ventes
     query = """
-        SELECT 
-            c.client_name, 
-            MAX(f.date_key) as last_order_date,
-            COUNT(DISTINCT f.order_id) as frequence,
-            SUM(f.montant_ht) as montant_total
-        FROM fact_ventes f
-        JOIN dim_client c ON f.client_id = c.client_id
-        GROUP BY c.client_name
+        SELECT m.client_id, c.client_name, m.last_order_date, m.frequence, m.montant_total
+        FROM mart_client_rfm m
+        LEFT JOIN dim_client c ON m.client_id = c.client_id
     """
+    return pd.read_sql(query, get_bi_engine())
+
+def load_daily_sales():
+    """Chiffre d'affaires par jour, depuis le mart exporté dans le snapshot ou le Data Warehouse"""
+    manifest = snapshot_marts()
+    if manifest:
+        daily = read_snapshot(manifest, 'mart_ventes_jour', ['date_key', 'montant_ht'])
+        return daily.rename(columns={'montant_ht': 'total_sales'}).sort_values('date_key').reset_index(drop=True)
+    query = "SELECT date_key, montant_ht as total_sales FROM mart_ventes_jour ORDER BY date_key"
+    return pd.read_sql(query, get_bi_engine())
+
+# --- CACHE DES RÉSULTATS (invalidé par la version du Data Warehouse publiée par l'ETL) ---
+ANALYTICS_CACHE_ENABLED = os.getenv("ANALYTICS_CACHE_ENABLED", "1") == "1"
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "128"))
+# Répertoire de persistance (les résultats survivent aux redémarrages) ; vide = mémoire seule
+ANALYTICS_CACHE_DIR = os.getenv("ANALYTICS_CACHE_DIR", "")
+# Durée pendant laquelle la version lue en base est réutilisée sans nouvelle requête
+WAREHOUSE_VERSION_TTL = float(os.getenv("WAREHOUSE_VERSION_TTL", "2"))
+
+class _Flight:
+    """Calcul en cours pour une clé : les requêtes identiques attendent son résultat"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class ResultCache:
+    """LRU thread-safe avec coalescence : dix requêtes identiques simultanées = un seul calcul"""
+
+    def __init__(self, maxsize, directory=""):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.coalesced = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + ".pkl")
+
+    def _load(self):
+        files = sorted((os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(".pkl")),
+                       key=os.path.getmtime)
+        for path in files[-self.maxsize:]:
+            try:
+                with open(path, "rb") as f:
+                    key, value = pickle.load(f)
+                self.entries[key] = value
+            except Exception:
+                os.remove(path)
+
+    def _store(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            evicted = []
+            while len(self.entries) > self.maxsize:
+                evicted.append(self.entries.popitem(last=False)[0])
+        if self.directory:
+            tmp = self._path(key) + ".tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump((key, value), f)
+            os.replace(tmp, self._path(key))
+            for old in evicted:
+                try:
+                    os.remove(self._path(old))
+                except FileNotFoundError:
+                    pass
+
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+            self._store(key, flight.value)
+            return flight.value
+        except Exception as e:
+            # Les erreurs ne sont jamais mises en cache, mais partagées avec les requêtes en attente
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            flight.done.set()
+
+    def peek(self, key, coalesced=False):
+        """Lecture seule (le calcul est piloté ailleurs, ex. par les jobs) ; compte succès, échecs et coalescences"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            if coalesced:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._store(key, value)
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                    "coalesced": self.coalesced, "inflight": len(self.inflight), "persistent": bool(self.directory)}
+
+result_cache = ResultCache(ANALYTICS_CACHE_SIZE, ANALYTICS_CACHE_DIR)
+_version_lock = threading.Lock()
+_version_state = {"value": None, "read_at": 0.0}
+
+def warehouse_version():
+    """(version du Data Warehouse, version du snapshot Parquet) ; None si l'ETL ne publie pas encore de version"""
+    with _version_lock:
+        if time.monotonic() - _version_state["read_at"] > WAREHOUSE_VERSION_TTL:
+            try:
+                with get_bi_engine().connect() as conn:
+                    version = conn.execute(text("SELECT version FROM warehouse_version WHERE id = 1")).scalar()
+            except Exception:
+                version = None
+            _version_state.update(value=version, read_at=time.monotonic())
+        version = _version_state["value"]
+    if version is None:
+        return None
+    manifest = read_manifest()
+    return version, manifest["version"] if manifest else None
+
+def cached(endpoint, params, compute):
+    """Résultat de `compute` mis en cache pour (endpoint, paramètres, version du Data Warehouse)"""
+    version = warehouse_version() if ANALYTICS_CACHE_ENABLED else None
+    if version is None:
+        return compute()
+    key = (endpoint, tuple(sorted(params.items())), version)
+    return result_cache.get_or_compute(key, compute)
+
+# Revalidation HTTP : ETag dérivé de la version du Data Warehouse et de la requête. Un client qui
+# renvoie If-None-Match reçoit 304 sans calcul ni transfert tant qu'aucun chargement n'a eu lieu.
+ETAG_PATHS = ("/mining/", "/kpis")
+
+@app.middleware("http")
+async def etag_middleware(request, call_next):
+    if request.method != "GET" or not request.url.path.startswith(ETAG_PATHS):
+        return await call_next(request)
+    version = await run_in_threadpool(warehouse_version)
+    if version is None:
+        return await call_next(request)
+    digest = hashlib.sha1(repr((version, request.url.path, sorted(request.query_params.multi_items()),
+                                request.headers.get("accept", ""))).encode()).hexdigest()[:24]
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers.update(headers)
+    return response
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    return {**result_cache.stats(), "enabled": ANALYTICS_CACHE_ENABLED, "warehouse_version": warehouse_version()}
+
+# --- FORMATS DE RÉPONSE (négociation de contenu sur /mining/*) ---
+# Header Accept ou paramètre ?format= : JSON par lignes (historique, par défaut), JSON par colonnes
+# (orjson), flux Arrow IPC ou Parquet. Les résultats tabulaires sont envoyés par blocs de
+# RESPONSE_CHUNK_ROWS lignes, sans construire une liste géante de dicts en mémoire.
+RESPONSE_CHUNK_ROWS = int(os.getenv("RESPONSE_CHUNK_ROWS", "50000"))
+RESPONSE_FORMATS = {
+    "json": "application/json",
+    "columns": "application/vnd.erp.columns+json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+ACCEPT_FORMATS = {**{media: fmt for fmt, media in RESPONSE_FORMATS.items()}, "application/x-parquet": "parquet"}
+
+def negotiate_format(request):
+    fmt = request.query_params.get("format")
+    if fmt is not None:
+        if fmt not in RESPONSE_FORMATS:
+            raise HTTPException(400, f"Format inconnu, valeurs possibles : {list(RESPONSE_FORMATS)}")
+        return fmt
+    for part in request.headers.get("accept", "").split(","):
+        fmt = ACCEPT_FORMATS.get(part.split(";")[0].strip().lower())
+        if fmt:
+            return fmt
+    return "json"
+
+def _json_default(obj):
+    if isinstance(obj, (pd.Timestamp, datetime)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if obj is pd.NaT:
+        return None
+    raise TypeError
+
+def dumps(obj):
+    return orjson.dumps(obj, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+def _chunks(rows):
+    for start in range(0, len(rows), RESPONSE_CHUNK_ROWS):
+        yield rows.iloc[start:start + RESPONSE_CHUNK_ROWS] if isinstance(rows, pd.DataFrame) else rows[start:start + RESPONSE_CHUNK_ROWS]
+
+def _json_rows(rows):
+    """Liste JSON de lignes, sérialisée bloc par bloc"""
+    yield b"["
+    for i, chunk in enumerate(_chunks(rows)):
+        records = chunk.to_dict(orient="records") if isinstance(chunk, pd.DataFrame) else chunk
+        yield (b"," if i else b"") + dumps(records)[1:-1]
+    yield b"]"
+
+def _json_columns(frame, meta):
+    """{"meta": {...}, "columns": [...], "data": {colonne: [valeurs]}} : une colonne = un tableau sérialisé d'un bloc"""
+    yield b'{"meta":' + dumps(meta) + b',"columns":' + dumps([str(c) for c in frame.columns]) + b',"data":{'
+    for i, col in enumerate(frame.columns):
+        values = frame[col]
+        if values.dtype.kind in "biuf":
+            encoded = dumps(values.to_numpy())
+        else:
+            encoded = dumps(values.astype(object).where(values.notna(), None).tolist())
+        yield (b"," if i else b"") + dumps(str(col)) + b":" + encoded
+    yield b"}}"
+
+def _drain(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+def _arrow_stream(table):
+    buffer = io.BytesIO()
+    with pa.ipc.new_stream(buffer, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=RESPONSE_CHUNK_ROWS):
+            writer.write_batch(batch)
+            yield _drain(buffer)
+    yield _drain(buffer)
+
+def _parquet_stream(table):
+    """Un groupe de lignes par bloc ; le pied de fichier (schéma, statistiques) part en dernier"""
+    buffer = io.BytesIO()
+    with pq.ParquetWriter(buffer, table.schema) as writer:
+        for start in range(0, max(table.num_rows, 1), RESPONSE_CHUNK_ROWS):
+            writer.write_table(table.slice(start, RESPONSE_CHUNK_ROWS))
+            yield _drain(buffer)
+    yield _drain(buffer)
+
+def tabular_response(request, payload, rows_key=None, to_frame=None):
+    """Réponse négociée pour un résultat tabulaire.
+
+    `payload` est soit la table elle-même (DataFrame ou liste de dicts), soit un dict dont `rows_key`
+    désigne la table ; les autres clés (statut, pagination…) passent dans l'objet JSON, ou dans le
+    header X-Result-Meta et les métadonnées du schéma pour Arrow et Parquet. Les résultats sans table
+    (message d'erreur métier, ex. pas assez de données) sont renvoyés tels quels en JSON.
+    """
+    fmt = negotiate_format(request)
+    if isinstance(payload, dict):
+        if rows_key not in payload:
+            return payload
+        meta = {k: v for k, v in payload.items() if k != rows_key}
+        rows = payload[rows_key]
+    else:
+        meta, rows = None, payload
+
+    if fmt == "json":
+        if meta is None:
+            body = _json_rows(rows)
+        else:
+            head = b",".join(dumps(k) + b":" + dumps(v) for k, v in meta.items())
+            body = iter([b"{" + head + (b"," if head else b"") + dumps(rows_key) + b":", *_json_rows(rows), b"}"])
+        return StreamingResponse(body, media_type=RESPONSE_FORMATS[fmt])
+
+    frame = to_frame(payload) if to_frame else (rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows))
+    headers = {"X-Result-Meta": dumps(meta).decode()} if meta else {}
+    if fmt == "columns":
+        body = _json_columns(frame, meta)
+    else:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if meta:
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"meta": dumps(meta)})
+        body = _arrow_stream(table) if fmt == "arrow" else _parquet_stream(table)
+    return StreamingResponse(body, media_type=RESPONSE_FORMATS[fmt], headers=headers)
+
+# --- 1. DATA MINING : SEGMENTATION RFM (K-MEANS) ---
+@app.get("/mining/rfm")
+def get_rfm_segmentation(request: Request):
+    return tabular_response(request, run_job_and_wait("rfm"))
+
+def compute_rfm_segmentation():
     try:
-        df = pd.read_sql(query, engine)
+        df = load_rfm_base()
         if df.empty or len(df) < 3:
             return {"status": "Pas assez de données pour le K-Means (Min: 3 clients). Lancez l'ETL."}
 
@@ -52,23 +435,348 @@ def get_rfm_segmentation():
         labels = {cluster_means.index[0]: 'À risque', cluster_means.index[1]: 'Occasionnels', cluster_means.index[2]: 'VIP'}
         df['segment'] = df['cluster'].map(labels)
 
-        return df[['client_name', 'recence', 'frequence', 'montant_total', 'segment']].to_dict(orient="records")
+        return df[['client_id', 'client_name', 'recence', 'frequence', 'montant_total', 'segment']].reset_index(drop=True)
     except Exception as e:
         raise HTTPException(500, f"Erreur RFM: {str(e)}")
 
+# --- 1 bis. SEGMENTATION RFM À GRANDE ÉCHELLE (MiniBatchKMeans incrémental) ---
+# Agrégats lus par blocs depuis mart_client_rfm (curseur serveur, types compacts). Seuls les clients
+# recalculés par l'ETL depuis le dernier passage (colonne load_version) alimentent partial_fit,
+# en repartant des centroïdes précédents. Réponse : résumé par segment + pages de clients.
+RFM_MODEL_DIR = os.getenv("RFM_MODEL_DIR", "models")
+RFM_CHUNK_SIZE = int(os.getenv("RFM_CHUNK_SIZE", "200000"))
+RFM_BATCH_SIZE = int(os.getenv("RFM_BATCH_SIZE", "4096"))
+# Réajustement complet tous les N passages incrémentaux, ou si une trop grande part des clients a changé
+RFM_REFIT_EVERY = int(os.getenv("RFM_REFIT_EVERY", "20"))
+RFM_REFIT_RATIO = float(os.getenv("RFM_REFIT_RATIO", "0.5"))
+RFM_PAGE_MAX = int(os.getenv("RFM_PAGE_MAX", "1000"))
+RFM_SEGMENTS = ['À risque', 'Occasionnels', 'VIP']
+
+def rfm_path(name):
+    return os.path.join(RFM_MODEL_DIR, name)
+
+def load_rfm_state():
+    try:
+        with open(rfm_path("rfm_state.pkl"), "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_rfm_state(state):
+    tmp = rfm_path("rfm_state.pkl.tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f)
+    os.replace(tmp, rfm_path("rfm_state.pkl"))
+
+def stream_client_aggregates(since=None):
+    """(version du Data Warehouse, agrégats des clients recalculés après `since` ou de tous les clients).
+
+    Version et lignes sont lues dans le même instantané (REPEATABLE READ) : une ligne estampillée
+    par un chargement non encore commité sera vue au passage suivant, jamais perdue.
+    """
+    query = "SELECT client_id, last_order_date, frequence, montant_total FROM mart_client_rfm"
+    params = None
+    if since is not None:
+        query += " WHERE COALESCE(load_version, 0) > %(since)s"
+        params = {"since": since}
+    frames = []
+    with get_bi_engine().connect() as conn:
+        conn = conn.execution_options(isolation_level="REPEATABLE READ", stream_results=True,
+                                      max_row_buffer=RFM_CHUNK_SIZE)
+        version = 0
+        if conn.execute(text("SELECT to_regclass('warehouse_version')")).scalar():
+            version = conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM warehouse_version")).scalar()
+        for chunk in pd.read_sql(query, conn, params=params, chunksize=RFM_CHUNK_SIZE):
+            frames.append(pd.DataFrame({
+                "client_id": chunk["client_id"].to_numpy("int64"),
+                # Jours depuis l'epoch : 4 octets par client au lieu d'un objet date
+                "last_day": pd.to_datetime(chunk["last_order_date"]).to_numpy("datetime64[D]").astype("int32"),
+                "frequence": chunk["frequence"].to_numpy("int32"),
+                "montant_total": chunk["montant_total"].to_numpy("float64"),
+            }))
+    columns = {"client_id": "int64", "last_day": "int32", "frequence": "int32", "montant_total": "float64"}
+    clients = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame({c: pd.Series(dtype=t) for c, t in columns.items()})
+    return version, clients
+
+def rfm_features(clients, reference_day):
+    return np.column_stack([
+        reference_day - clients["last_day"].to_numpy("float64"),
+        clients["frequence"].to_numpy("float64"),
+        clients["montant_total"].to_numpy("float64"),
+    ])
+
+def fit_rfm_full(clients, reference_day, previous):
+    """Ajustement sur tous les clients ; centroïdes du modèle précédent (ramenés à la nouvelle échelle) comme départ"""
+    features = rfm_features(clients, reference_day)
+    scaler = StandardScaler().fit(features)
+    scaled = scaler.transform(features)
+    if previous is not None:
+        init = scaler.transform(previous["scaler"].inverse_transform(previous["model"].cluster_centers_))
+        model = MiniBatchKMeans(n_clusters=3, init=init, n_init=1, batch_size=RFM_BATCH_SIZE, random_state=42)
+    else:
+        model = MiniBatchKMeans(n_clusters=3, n_init=3, batch_size=RFM_BATCH_SIZE, random_state=42)
+    model.fit(scaled)
+    return scaler, model
+
+def score_rfm(state, clients, reference_day):
+    return state["model"].predict(state["scaler"].transform(rfm_features(clients, reference_day))).astype("int8")
+
+def rfm_labels(state):
+    """Segment de chaque cluster, ordonné par montant du centroïde : À risque < Occasionnels < VIP"""
+    centers = state["scaler"].inverse_transform(state["model"].cluster_centers_)
+    labels = np.empty(3, dtype=object)
+    labels[np.argsort(centers[:, 2])] = RFM_SEGMENTS
+    return labels
+
+def write_rfm_scores(clients, reference_day, labels):
+    """Scores triés par client_id : les pages (client_id > after) ne lisent que les groupes de lignes utiles"""
+    table = pa.table({
+        "client_id": clients["client_id"].to_numpy(),
+        "recence": (reference_day - clients["last_day"].to_numpy()).astype("int32"),
+        "frequence": clients["frequence"].to_numpy(),
+        "montant_total": clients["montant_total"].to_numpy(),
+        "segment": pa.array(labels[clients["cluster"].to_numpy()].astype(str)).dictionary_encode(),
+    })
+    tmp = rfm_path("rfm_scores.parquet.tmp")
+    pq.write_table(table, tmp, row_group_size=RFM_CHUNK_SIZE // 4)
+    os.replace(tmp, rfm_path("rfm_scores.parquet"))
+
+def rfm_summary(state, clients, reference_day, mode, scored):
+    labels = rfm_labels(state)
+    cluster = clients["cluster"].to_numpy()
+    counts = np.bincount(cluster, minlength=3)
+    sums = {col: np.bincount(cluster, weights=values, minlength=3) for col, values in (
+        ("recence", reference_day - clients["last_day"].to_numpy("float64")),
+        ("frequence", clients["frequence"].to_numpy("float64")),
+        ("montant_total", clients["montant_total"].to_numpy("float64")))}
+    segments = []
+    for c in np.argsort([RFM_SEGMENTS.index(label) for label in labels])[::-1]:
+        n = int(counts[c])
+        segments.append({
+            "segment": labels[c], "nb_clients": n,
+            "recence_moyenne": round(sums["recence"][c] / n, 1) if n else None,
+            "frequence_moyenne": round(sums["frequence"][c] / n, 2) if n else None,
+            "montant_moyen": round(sums["montant_total"][c] / n, 2) if n else None,
+            "montant_total": round(float(sums["montant_total"][c]), 2),
+        })
+    return {
+        "status": "success", "mode": mode, "version": state["version"],
+        "reference_date": str(np.datetime64(int(reference_day), "D")),
+        "total_clients": int(len(clients)), "scored_clients": int(scored), "segments": segments,
+    }
+
+def compute_rfm_scalable():
+    """Job RFM incrémental : partial_fit sur les clients modifiés, scoring vectorisé, état persisté sur disque"""
+    os.makedirs(RFM_MODEL_DIR, exist_ok=True)
+    # Deux processus de calcul peuvent traiter deux versions différentes : l'état est mis à jour en exclusion
+    with open(rfm_path("rfm.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = load_rfm_state()
+        incremental = state is not None and state["incremental_runs"] < RFM_REFIT_EVERY
+        version, changed = stream_client_aggregates(since=state["version"] if incremental else None)
+        if state is not None and incremental and version == state["version"]:
+            return state["summary"]
+
+        if incremental and len(changed) > RFM_REFIT_RATIO * len(state["clients"]):
+            # Trop de clients modifiés (ex. reconstruction complète) : réajustement sur l'ensemble
+            incremental = False
+            version, changed = stream_client_aggregates()
+        if incremental:
+            clients = state["clients"]
+            # Fusion vectorisée : les lignes recalculées remplacent les anciennes, les nouveaux clients s'ajoutent
+            clients = (pd.concat([clients[~clients["client_id"].isin(changed["client_id"])], changed.assign(cluster=np.int8(0))])
+                       .sort_values("client_id", ignore_index=True))
+            reference_day = int(clients["last_day"].max())
+            if len(changed):
+                scaled = state["scaler"].transform(rfm_features(changed, reference_day))
+                for start in range(0, len(scaled), RFM_BATCH_SIZE):
+                    state["model"].partial_fit(scaled[start:start + RFM_BATCH_SIZE])
+            # Date de référence inchangée : seuls les clients modifiés sont re-scorés ; sinon la récence
+            # de tous les clients a glissé et le scoring (prédiction vectorisée, sans ajustement) couvre tout
+            # (aucun client modifié : version relevée par une synchronisation de dimensions seule)
+            if reference_day == state["reference_day"]:
+                scope = clients["client_id"].isin(changed["client_id"]).to_numpy()
+                scored = int(scope.sum())
+                if scored:
+                    clients.loc[scope, "cluster"] = score_rfm(state, clients[scope], reference_day)
+            else:
+                clients["cluster"] = score_rfm(state, clients, reference_day)
+                scored = len(clients)
+            state.update(incremental_runs=state["incremental_runs"] + 1)
+            mode = "incremental"
+        else:
+            clients = changed
+            if len(clients) < 3:
+                return {"status": "Pas assez de données pour le K-Means (Min: 3 clients). Lancez l'ETL."}
+            reference_day = int(clients["last_day"].max())
+            scaler, model = fit_rfm_full(clients, reference_day, state)
+            state = {"scaler": scaler, "model": model, "incremental_runs": 0}
+            clients["cluster"] = score_rfm(state, clients, reference_day)
+            scored = len(clients)
+            mode = "full"
+
+        write_rfm_scores(clients, reference_day, rfm_labels(state))
+        summary = rfm_summary({**state, "version": version}, clients, reference_day, mode, scored)
+        state.update(version=version, reference_day=reference_day, clients=clients, summary=summary,
+                     fitted_at=datetime.utcnow().isoformat())
+        save_rfm_state(state)
+        return summary
+
+@app.get("/mining/rfm/segments")
+def get_rfm_segments(request: Request):
+    """Résumé par segment (effectifs et moyennes R/F/M) du modèle RFM incrémental"""
+    return tabular_response(request, run_job_and_wait("rfm_scalable"), "segments")
+
+@app.get("/mining/rfm/clients")
+def get_rfm_clients(request: Request, segment: Optional[str] = None, after: int = 0, limit: int = 100,
+                    recence_min: Optional[int] = None, recence_max: Optional[int] = None,
+                    frequence_min: Optional[int] = None, frequence_max: Optional[int] = None):
+    """Page de clients scorés, par client_id croissant (pagination par clé : passer next_after en `after`).
+    Les bornes min/max (intervalles [min, max[) permettent d'explorer une cellule de /mining/rfm/density."""
+    if segment is not None and segment not in RFM_SEGMENTS:
+        raise HTTPException(400, f"Segment inconnu, valeurs possibles : {RFM_SEGMENTS}")
+    summary = run_job_and_wait("rfm_scalable")
+    if "segments" not in summary:
+        return summary
+    limit = max(1, min(limit, RFM_PAGE_MAX))
+    scores = pq.ParquetFile(rfm_path("rfm_scores.parquet"))
+    client_col = scores.schema_arrow.get_field_index("client_id")
+    pages = [scores.schema_arrow.empty_table().to_pandas()]
+    found = 0
+    for i in range(scores.num_row_groups):
+        column_stats = scores.metadata.row_group(i).column(client_col).statistics
+        if column_stats is not None and column_stats.has_min_max and column_stats.max <= after:
+            continue
+        rows = scores.read_row_group(i).to_pandas()
+        rows = rows[rows["client_id"] > after]
+        if segment is not None:
+            rows = rows[rows["segment"] == segment]
+        for column, low, high in (("recence", recence_min, recence_max), ("frequence", frequence_min, frequence_max)):
+            if low is not None:
+                rows = rows[rows[column] >= low]
+            if high is not None:
+                rows = rows[rows[column] < high]
+        pages.append(rows.head(limit - found))
+        found += len(pages[-1])
+        if found >= limit:
+            break
+    page = pd.concat(pages, ignore_index=True)
+    page["segment"] = page["segment"].astype(str)
+    if len(page):
+        # Noms résolus pour les seuls clients de la page
+        with get_bi_engine().connect() as conn:
+            names = dict(conn.execute(
+                text("SELECT client_id, client_name FROM dim_client WHERE client_id IN :ids")
+                .bindparams(bindparam("ids", expanding=True)),
+                {"ids": [int(i) for i in page["client_id"]]},
+            ).fetchall())
+        page.insert(1, "client_name", page["client_id"].map(names))
+    return tabular_response(request, {
+        "version": summary["version"], "segment": segment, "count": len(page),
+        "next_after": int(page["client_id"].iloc[-1]) if found >= limit else None,
+        "items": page,
+    }, "items")
+
+# Carte de densité récence × fréquence par segment : cellules agrégées et échantillon représentatif
+# borné (max_points), à la place de l'envoi de tous les clients au navigateur
+RFM_DENSITY_MAX_BINS = 200
+RFM_DENSITY_MAX_POINTS = 20000
+
+def rfm_bin_edges(values, bins, log=False):
+    """Bornes entières de min à max + 1 : chaque cellule est un intervalle [borne, borne suivante[,
+    réutilisable tel quel comme filtre de /mining/rfm/clients. Échelle log pour la fréquence (longue traîne)."""
+    low, high = int(values.min()), int(values.max()) + 1
+    edges = np.geomspace(max(low, 1), high, bins + 1) if log else np.linspace(low, high, bins + 1)
+    return np.unique(np.concatenate([[low], np.round(edges).astype("int64"), [high]]))
+
+def compute_rfm_density(version, bins, max_points):
+    scores = pq.read_table(rfm_path("rfm_scores.parquet"), memory_map=True).to_pandas()
+    recence = scores["recence"].to_numpy()
+    frequence = scores["frequence"].to_numpy()
+    montant = scores["montant_total"].to_numpy("float64")
+    segments = scores["segment"].astype("category")
+    labels, seg_code = list(segments.cat.categories), segments.cat.codes.to_numpy()
+
+    rec_edges, freq_edges = rfm_bin_edges(recence, bins), rfm_bin_edges(frequence, bins, log=True)
+    nx, ny = len(rec_edges) - 1, len(freq_edges) - 1
+    ix = np.searchsorted(rec_edges, recence, side="right") - 1
+    iy = np.searchsorted(freq_edges, frequence, side="right") - 1
+    cell = (seg_code.astype("int64") * nx + ix) * ny + iy
+    size = len(labels) * nx * ny
+    counts = np.bincount(cell, minlength=size)
+    totals = np.bincount(cell, weights=montant, minlength=size)
+
+    used = np.flatnonzero(counts)
+    used_seg, rest = np.divmod(used, nx * ny)
+    used_x, used_y = np.divmod(rest, ny)
+    cells = pd.DataFrame({
+        "segment": np.asarray(labels, dtype=object)[used_seg], "ix": used_x, "iy": used_y,
+        "recence_min": rec_edges[used_x], "recence_max": rec_edges[used_x + 1],
+        "frequence_min": freq_edges[used_y], "frequence_max": freq_edges[used_y + 1],
+        "nb_clients": counts[used], "montant_total": np.round(totals[used], 2),
+        "montant_moyen": np.round(totals[used] / counts[used], 2),
+    })
+
+    # Échantillon stratifié : quota de chaque cellule proportionnel à son effectif, au moins un point
+    # pour les plus grosses cellules restantes tant que le budget le permet ; tirage reproductible
+    quota = np.floor(max_points * counts / max(len(cell), 1)).astype("int64")
+    spare = max_points - int(quota.sum())
+    if spare > 0:
+        empty = np.flatnonzero((quota == 0) & (counts > 0))
+        quota[empty[np.argsort(-counts[empty], kind="stable")][:spare]] = 1
+    order = np.lexsort((np.random.default_rng(42).random(len(cell)), cell))
+    sorted_cells = cell[order]
+    rank = np.arange(len(cell)) - np.searchsorted(sorted_cells, sorted_cells, side="left")
+    picked = np.sort(order[rank < quota[sorted_cells]])
+    samples = scores.iloc[picked][["client_id", "recence", "frequence", "montant_total"]].reset_index(drop=True)
+    samples["segment"] = segments.iloc[picked].astype(str).to_numpy()
+    samples["ix"], samples["iy"] = ix[picked], iy[picked]
+
+    return {
+        "status": "success", "version": version, "total_clients": int(len(cell)), "max_points": max_points,
+        "bins": {"recence": rec_edges.tolist(), "frequence": freq_edges.tolist()},
+        "cells": cells, "samples": samples,
+    }
+
+def rfm_density(bins, max_points):
+    if not 2 <= bins <= RFM_DENSITY_MAX_BINS:
+        raise HTTPException(400, f"Nombre de classes hors limites (2 à {RFM_DENSITY_MAX_BINS})")
+    if not 0 <= max_points <= RFM_DENSITY_MAX_POINTS:
+        raise HTTPException(400, f"max_points hors limites (0 à {RFM_DENSITY_MAX_POINTS})")
+    summary = run_job_and_wait("rfm_scalable")
+    if "segments" not in summary:
+        return summary
+    return cached("rfm_density", {"bins": bins, "max_points": max_points},
+                  lambda: compute_rfm_density(summary["version"], bins, max_points))
+
+@app.get("/mining/rfm/density")
+def get_rfm_density(request: Request, bins: int = 40, max_points: int = 2000):
+    """Cellules (segment × classe de récence × classe de fréquence) : effectif et montants"""
+    result = rfm_density(bins, max_points)
+    return tabular_response(request, {k: v for k, v in result.items() if k != "samples"}, "cells")
+
+@app.get("/mining/rfm/density/samples")
+def get_rfm_density_samples(request: Request, bins: int = 40, max_points: int = 2000):
+    """Échantillon représentatif (au plus max_points clients) de la même carte de densité"""
+    result = rfm_density(bins, max_points)
+    return tabular_response(request, {k: v for k, v in result.items() if k != "cells"}, "samples")
+
 # --- 2. SÉRIES TEMPORELLES : PRÉDICTIONS ARIMA ---
 @app.get("/mining/predictions")
-def get_sales_predictions():
-    engine = get_bi_engine()
-    query = "SELECT date_key, SUM(montant_ht) as total_sales FROM fact_ventes GROUP BY date_key ORDER BY date_key"
+def get_sales_predictions(request: Request):
+    return tabular_response(request, run_job_and_wait("forecast"), "data")
+
+def compute_sales_predictions():
     try:
-        df = pd.read_sql(query, engine)
+        df = load_daily_sales()
         if len(df) < 5:
             return {"status": "mock", "message": "Simulation des 3 prochains mois (pas assez d'historique).", 
                     "data": [{"date": "Mois +1", "prediction": 12500}, {"date": "Mois +2", "prediction": 13200}, {"date": "Mois +3", "prediction": 14100}]}
         
         df['date_key'] = pd.to_datetime(df['date_key'])
         df.set_index('date_key', inplace=True)
+        # Grille journalière régulière : les jours sans vente valent 0 au lieu d'être absents
+        df = df.asfreq('D', fill_value=0)
         
         model = ARIMA(df['total_sales'], order=(1, 1, 1))
         fitted = model.fit()
@@ -79,18 +787,557 @@ def get_sales_predictions():
         df_forecast['month'] = df_forecast['date'].dt.strftime('%Y-%m')
         monthly_forecast = df_forecast.groupby('month')['prediction'].sum().reset_index()
 
-        return {"status": "success", "data": monthly_forecast.to_dict(orient="records")}
+        return {"status": "success", "data": monthly_forecast}
     except Exception as e:
         raise HTTPException(500, f"Erreur ARIMA: {str(e)}")
 
+# --- 2 bis. PRÉVISIONS PAR SÉRIE (produits, segments clients) ---
+# Un ARIMA par série (quantités par produit pour le réapprovisionnement, CA par segment client).
+# Chaque lot est un job (file bornée, délai, coalescence, cache par version) : le processus de calcul
+# qui l'exécute répartit les séries sur un pool dimensionné à sa part des cœurs. Les paramètres sont persistés : tant que moins de
+# FORECAST_REFIT_DAYS jours se sont ajoutés, ils sont réappliqués aux nouvelles observations (filtre
+# de Kalman, sans optimisation) ; au-delà, réajustement en partant des paramètres précédents.
+FORECAST_MODEL_DIR = os.getenv("FORECAST_MODEL_DIR", RFM_MODEL_DIR)
+# Processus d'ajustement par job ; 0 = part des cœurs d'un processus de calcul (cpu_count // JOB_WORKERS)
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", "0"))
+FORECAST_HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "730"))
+FORECAST_REFIT_DAYS = int(os.getenv("FORECAST_REFIT_DAYS", "7"))
+FORECAST_MAX_SERIES = int(os.getenv("FORECAST_MAX_SERIES", "5000"))
+FORECAST_MAX_HORIZON = 365
+FORECAST_ORDER = (1, 1, 1)
+# En dessous de ce nombre de jours avec ventes, prévision par la moyenne récente (ARIMA non identifiable)
+FORECAST_MIN_DAYS = 28
+# Séries par tâche envoyée au pool : amortit la sérialisation sur des milliers de petites séries
+FORECAST_TASK_SIZE = 16
+FORECAST_METRICS = {"product": "quantity", "segment": "montant_ht"}
+
+def parse_series(series_id):
+    kind, _, key = series_id.partition(":")
+    if kind == "product" and (key == "*" or key.isdigit()):
+        return kind, key
+    if kind == "segment" and key:
+        return kind, key
+    raise HTTPException(400, f"Série invalide : {series_id} (attendu product:<id>, segment:<nom> ou <type>:*)")
+
+def resolve_series(conn, requested, start):
+    """Liste ordonnée et dédoublonnée des séries ; product:* / segment:* développés depuis le Data Warehouse"""
+    resolved = []
+    for kind, key in (parse_series(s) for s in requested):
+        if key != "*":
+            resolved.append(f"{kind}:{key}")
+        elif kind == "product":
+            resolved += [f"product:{i}" for i in conn.execute(text(
+                "SELECT DISTINCT product_id FROM mart_produit_jour WHERE date_key >= :start ORDER BY product_id"),
+                {"start": start}).scalars()]
+        else:
+            resolved += [f"segment:{s}" for s in conn.execute(text(
+                "SELECT DISTINCT segment FROM dim_client WHERE segment IS NOT NULL ORDER BY segment")).scalars()]
+    resolved = list(dict.fromkeys(resolved))
+    if len(resolved) > FORECAST_MAX_SERIES:
+        raise HTTPException(400, f"Trop de séries demandées ({len(resolved)} > {FORECAST_MAX_SERIES})")
+    return resolved
+
+def load_series(requested):
+    """Séries journalières denses sur FORECAST_HISTORY_DAYS (0 les jours sans vente), une ligne par série"""
+    with get_bi_engine().connect() as conn:
+        end = conn.execute(text("SELECT MAX(date_key) FROM mart_ventes_jour")).scalar()
+        if end is None:
+            return None, [], None
+        start = end - timedelta(days=FORECAST_HISTORY_DAYS - 1)
+        series_ids = resolve_series(conn, requested, start)
+        products = [int(s.split(":", 1)[1]) for s in series_ids if s.startswith("product:")]
+        segments = [s.split(":", 1)[1] for s in series_ids if s.startswith("segment:")]
+        frames = []
+        if products:
+            frames.append(pd.read_sql(text("""
+                SELECT 'product:' || product_id AS series_id, date_key, quantity::float8 AS value
+                FROM mart_produit_jour WHERE product_id IN :ids AND date_key >= :start
+            """).bindparams(bindparam("ids", expanding=True)), conn, params={"ids": products, "start": start}))
+        if segments:
+            frames.append(pd.read_sql(text("""
+                SELECT 'segment:' || segment AS series_id, date_key, montant_ht AS value
+                FROM mart_segment_jour WHERE segment IN :segments AND date_key >= :start
+            """).bindparams(bindparam("segments", expanding=True)), conn, params={"segments": segments, "start": start}))
+    grid = np.zeros((len(series_ids), FORECAST_HISTORY_DAYS))
+    if frames:
+        observed = pd.concat(frames, ignore_index=True)
+        rows = pd.Index(series_ids).get_indexer(observed["series_id"])
+        cols = (pd.to_datetime(observed["date_key"]) - pd.Timestamp(start)).dt.days.to_numpy()
+        grid[rows, cols] = observed["value"].to_numpy("float64")
+    return end, series_ids, grid
+
+def fit_forecast(values, state, horizon, end_day):
+    """(état persistant, prévision) d'une série ; `values` commence à sa première vente"""
+    if np.count_nonzero(values) < FORECAST_MIN_DAYS:
+        level = float(values[-FORECAST_MIN_DAYS:].mean()) if len(values) else 0.0
+        return state, {"method": "moyenne", "refit": False, "values": [round(level, 2)] * horizon}
+    model = ARIMA(values, order=FORECAST_ORDER)
+    reusable = (state is not None and state["order"] == FORECAST_ORDER
+                and 0 <= end_day - state["end_day"] <= FORECAST_REFIT_DAYS)
+    if reusable:
+        results = model.filter(state["params"])
+    else:
+        start_params = state["params"] if state is not None and state["order"] == FORECAST_ORDER else None
+        results = model.fit(start_params=start_params)
+        state = {"order": FORECAST_ORDER, "params": results.params, "end_day": end_day,
+                 "nobs": len(values), "fitted_at": datetime.utcnow().isoformat()}
+    forecast = np.maximum(results.forecast(horizon), 0)
+    return state, {"method": "arima", "refit": not reusable, "values": np.round(forecast, 2).tolist()}
+
+def fit_forecast_batch(tasks, horizon, end_day):
+    """Exécuté dans le pool : un échec sur une série n'interrompt pas les autres"""
+    results = []
+    for series_id, values, state in tasks:
+        try:
+            results.append((series_id, *fit_forecast(values, state, horizon, end_day), None))
+        except Exception as e:
+            results.append((series_id, state, None, f"{type(e).__name__}: {e}"))
+    return results
+
+# Lues par OpenBLAS/MKL/OpenMP au chargement de numpy : posées avant le spawn du pool, héritées par ses processus
+FORECAST_BLAS_THREAD_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+
+def _init_forecast_worker():
+    # Un processus par cœur attribué : BLAS limité à un thread pour ne pas sursouscrire les cœurs.
+    # Sans threadpoolctl, les variables FORECAST_BLAS_THREAD_VARS posées par forecast_pool suffisent.
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(1)
+
+_forecast_pool = None
+_forecast_pool_lock = threading.Lock()
+
+def forecast_pool():
+    global _forecast_pool
+    with _forecast_pool_lock:
+        if _forecast_pool is None:
+            # Pool créé dans le processus de calcul du job : JOB_WORKERS jobs simultanés se partagent les cœurs
+            workers = FORECAST_WORKERS or max(1, (os.cpu_count() or 2) // JOB_WORKERS)
+            for name in FORECAST_BLAS_THREAD_VARS:
+                os.environ[name] = "1"
+            _forecast_pool = ProcessPoolExecutor(max_workers=workers,
+                                                 mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_init_forecast_worker)
+        return _forecast_pool
+
+def reset_forecast_pool():
+    global _forecast_pool
+    with _forecast_pool_lock:
+        if _forecast_pool is not None:
+            _forecast_pool.shutdown(wait=False, cancel_futures=True)
+        _forecast_pool = None
+
+def forecast_store_path(name="forecast_models.pkl"):
+    return os.path.join(FORECAST_MODEL_DIR, name)
+
+def load_forecast_store():
+    try:
+        with open(forecast_store_path(), "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_forecast_states(updates):
+    """Fusion sous verrou : deux lots concurrents ne s'écrasent pas leurs paramètres"""
+    with open(forecast_store_path("forecast_models.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        store = load_forecast_store()
+        store.update(updates)
+        tmp = forecast_store_path("forecast_models.pkl.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(store, f)
+        os.replace(tmp, forecast_store_path())
+
+def run_forecasts(requested, horizon):
+    started = time.perf_counter()
+    end, series_ids, grid = load_series(requested)
+    if end is None:
+        return {"status": "Pas de ventes dans le Data Warehouse. Lancez l'ETL."}
+    os.makedirs(FORECAST_MODEL_DIR, exist_ok=True)
+    store = load_forecast_store()
+    end_day = int(np.datetime64(end, "D").astype("int64"))
+    has_sales = grid > 0
+    first = np.where(has_sales.any(axis=1), has_sales.argmax(axis=1), grid.shape[1])
+    tasks = [(sid, grid[i, first[i]:], store.get(sid)) for i, sid in enumerate(series_ids)]
+    chunks = [tasks[i:i + FORECAST_TASK_SIZE] for i in range(0, len(tasks), FORECAST_TASK_SIZE)]
+    pool = forecast_pool()
+    try:
+        futures = [pool.submit(fit_forecast_batch, chunk, horizon, end_day) for chunk in chunks]
+        outcomes = {}
+        for future in as_completed(futures):
+            for series_id, state, forecast, error in future.result():
+                outcomes[series_id] = (state, forecast, error)
+    except BrokenProcessPool:
+        reset_forecast_pool()
+        raise HTTPException(500, "Pool de prévision interrompu, réessayez")
+    save_forecast_states({sid: state for sid, (state, _, error) in outcomes.items() if state is not None and error is None})
+
+    first_date = (end + timedelta(days=1)).isoformat()
+    series, errors = [], []
+    for sid in series_ids:
+        state, forecast, error = outcomes[sid]
+        if error is not None:
+            errors.append({"series_id": sid, "error": error})
+            continue
+        series.append({"series_id": sid, "metric": FORECAST_METRICS[sid.split(":", 1)[0]], **forecast})
+    return {
+        "status": "success", "horizon": horizon, "last_date": end.isoformat(), "start_date": first_date,
+        "series": series, "errors": errors,
+        "refitted": sum(1 for s in series if s["refit"]), "duration_s": round(time.perf_counter() - started, 3),
+    }
+
+def forecast_frame(payload):
+    """Format long (une ligne par série et par jour) pour les sorties Arrow, Parquet et colonnes"""
+    series = payload["series"]
+    horizon = payload["horizon"]
+    dates = pd.date_range(payload["start_date"], periods=horizon, freq="D")
+    return pd.DataFrame({
+        "series_id": np.repeat([s["series_id"] for s in series], horizon),
+        "metric": np.repeat([s["metric"] for s in series], horizon),
+        "method": np.repeat([s["method"] for s in series], horizon),
+        "date": np.tile(dates.values, len(series)),
+        "prediction": np.concatenate([s["values"] for s in series]) if series else np.empty(0),
+    })
+
+@app.get("/mining/forecasts")
+def get_series_forecasts(request: Request,
+                         series: List[str] = Query(..., description="product:<id>, segment:<nom>, product:* ou segment:*"),
+                         horizon: int = 30):
+    """Prévisions journalières (à partir de start_date) pour l'ensemble de séries demandé"""
+    if not 1 <= horizon <= FORECAST_MAX_HORIZON:
+        raise HTTPException(400, f"Horizon hors limites (1 à {FORECAST_MAX_HORIZON} jours)")
+    for s in series:
+        parse_series(s)
+    result = run_job_and_wait("series_forecast", {"requested": tuple(sorted(set(series))), "horizon": horizon})
+    return tabular_response(request, result, "series", to_frame=forecast_frame)
+
 # --- 3. FOURNISSEUR DE KPI POUR L'IA ---
-@app.get("/kpis")
-def get_kpis():
-    """Fournit les chiffres globaux au Dashboard pour nourrir l'IA"""
-    engine = get_bi_engine()
+# Un panneau de KPI = une seule requête d'agrégat : toutes les mesures demandées, les totaux et la
+# série par période (GROUPING SETS). La source la plus compacte capable de répondre est choisie :
+# mart journalier, puis mart produit/jour, et fact_ventes seulement si un filtre ou une mesure l'exige.
+KPI_SOURCES = ["mart_ventes_jour", "mart_produit_jour", "fact_ventes"]
+KPI_MEASURES = {
+    # mesure : expression par source (None = non calculable depuis cette source)
+    "ca": ("SUM(f.montant_ht)", "SUM(f.montant_ht)", "SUM(f.montant_ht)"),
+    "marge": ("SUM(f.marge)", "SUM(f.marge)", "SUM(f.marge)"),
+    "quantite": ("SUM(f.quantity)::bigint", "SUM(f.quantity)::bigint", "SUM(f.quantity)::bigint"),
+    "nb_commandes": ("SUM(f.nb_commandes)::bigint", None, "COUNT(DISTINCT f.order_id)"),
+    "nb_lignes": ("SUM(f.nb_lignes)::bigint", None, "COUNT(*)"),
+    "nb_clients": (None, None, "COUNT(DISTINCT f.client_id)"),
+    "panier_moyen": ("SUM(f.montant_ht) / NULLIF(SUM(f.nb_commandes), 0)", None,
+                     "SUM(f.montant_ht) / NULLIF(COUNT(DISTINCT f.order_id), 0)"),
+    "taux_marge": ("SUM(f.marge) / NULLIF(SUM(f.montant_ht), 0)", "SUM(f.marge) / NULLIF(SUM(f.montant_ht), 0)",
+                   "SUM(f.marge) / NULLIF(SUM(f.montant_ht), 0)"),
+}
+KPI_DEFAULT_MEASURES = ["ca", "marge", "quantite", "nb_commandes", "panier_moyen", "taux_marge"]
+# Regroupements : mois et saison via dim_temps
+KPI_GROUPS = {
+    "day": "f.date_key",
+    "month": "to_char(make_date(t.annee, t.mois, 1), 'YYYY-MM')",
+    "season": "t.saison",
+}
+
+def kpi_source(measures, product_ids, segments, magasin_ids):
+    candidates = []
+    if not (product_ids or segments or magasin_ids):
+        candidates.append(0)
+    if not (segments or magasin_ids):
+        candidates.append(1)
+    candidates.append(2)
+    return next(i for i in candidates if all(KPI_MEASURES[m][i] for m in measures))
+
+def compute_kpis(measures=None, group_by="none", start=None, end=None, product_ids=None, segments=None, magasin_ids=None):
+    measures = measures or KPI_DEFAULT_MEASURES
+    source = kpi_source(measures, product_ids, segments, magasin_ids)
+    columns = [f"{KPI_MEASURES[m][source]} AS {m}" for m in measures]
+    joins, where, params, expanding = [], [], {}, []
+    if start is not None:
+        where.append("f.date_key >= :start")
+        params["start"] = start
+    if end is not None:
+        where.append("f.date_key <= :end")
+        params["end"] = end
+    for column, values, name in (("f.product_id", product_ids, "products"), ("c.segment", segments, "segments"),
+                                 ("f.magasin_id", magasin_ids, "magasins")):
+        if values:
+            where.append(f"{column} IN :{name}")
+            params[name] = list(values)
+            expanding.append(bindparam(name, expanding=True))
+    if segments:
+        joins.append("JOIN dim_client c ON c.client_id = f.client_id")
+    grouping = ""
+    if group_by != "none":
+        if group_by in ("month", "season"):
+            joins.append("JOIN dim_temps t ON t.date_key = f.date_key")
+        expr = KPI_GROUPS[group_by]
+        columns = [f"{expr} AS periode", f"GROUPING({expr}) AS total_row"] + columns
+        grouping = f"GROUP BY GROUPING SETS (({expr}), ()) ORDER BY total_row DESC, periode"
+    statement = text(f"SELECT {', '.join(columns)} FROM {KPI_SOURCES[source]} f {' '.join(joins)} "
+                     f"WHERE {' AND '.join(where) or 'TRUE'} {grouping}")
+    if expanding:
+        statement = statement.bindparams(*expanding)
+
+    result = {"source": KPI_SOURCES[source], "group_by": group_by, "measures": measures,
+              "filters": {"start": start, "end": end, "product_id": product_ids, "segment": segments,
+                          "magasin_id": magasin_ids}}
     try:
-        ca = pd.read_sql("SELECT SUM(montant_ht) as total FROM fact_ventes", engine).iloc[0]['total']
-        marge = pd.read_sql("SELECT SUM(marge) as total FROM fact_ventes", engine).iloc[0]['total']
-        return {"ca_total": float(ca) if pd.notna(ca) else 0, "marge_totale": float(marge) if pd.notna(marge) else 0}
-    except Exception:
-        return {"ca_total": 0, "marge_totale": 0}
\ No newline at end of file
+        with get_bi_engine().connect() as conn:
+            if conn.execute(text("SELECT to_regclass(:name)"), {"name": KPI_SOURCES[source]}).scalar():
+                rows = [dict(r) for r in conn.execute(statement, params).mappings()]
+            else:
+                # Data Warehouse pas encore chargé : panneau vide (état réel, pas une erreur passagère)
+                rows = []
+    except SQLAlchemyError as e:
+        # Erreur passagère (verrou, connexion, bascule des marts) : jamais un panneau vide mis en cache
+        raise HTTPException(503, f"Data Warehouse indisponible, réessayez : {type(e).__name__}")
+    totals = {m: None for m in measures}
+    if rows:
+        totals = {m: rows[0][m] for m in measures}
+    result.update(totals=totals, series=[{k: v for k, v in r.items() if k != "total_row"} for r in rows[1:]])
+    # Clés historiques lues par le Dashboard (génération du commentaire par l'IA)
+    for measure, key in (("ca", "ca_total"), ("marge", "marge_totale")):
+        if measure in totals:
+            result[key] = totals[measure] or 0
+    return result
+
+@app.get("/kpis")
+def get_kpis(measures: List[str] = Query(None), group_by: Literal["none", "day", "month", "season"] = "none",
+             start: Optional[date] = None, end: Optional[date] = None, product_id: List[int] = Query(None),
+             segment: List[str] = Query(None), magasin_id: List[int] = Query(None)):
+    """Panneau de KPI en un appel : mesures demandées, filtrées et regroupées, plus les totaux"""
+    unknown = sorted(set(measures or []) - set(KPI_MEASURES))
+    if unknown:
+        raise HTTPException(400, f"Mesures inconnues : {unknown} (disponibles : {list(KPI_MEASURES)})")
+    if start and end and start > end:
+        raise HTTPException(400, "La date de début doit précéder la date de fin")
+    params = {"measures": tuple(dict.fromkeys(measures or [])), "group_by": group_by, "start": start, "end": end,
+              "product_id": tuple(sorted(set(product_id or []))), "segment": tuple(sorted(set(segment or []))),
+              "magasin_id": tuple(sorted(set(magasin_id or [])))}
+    return cached("kpis", params, lambda: compute_kpis(
+        list(params["measures"]) or None, group_by, start, end,
+        list(params["product_id"]), list(params["segment"]), list(params["magasin_id"])))
+
+# --- 4. JOBS DE MINING (pool de processus dédié aux ajustements de modèles) ---
+# Les ajustements KMeans / ARIMA tournent dans des processus séparés : ni le GIL ni les threads
+# de FastAPI ne sont monopolisés, et /kpis reste réactif pendant un calcul lourd.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_TIMEOUT_SECONDS = float(os.getenv("JOB_TIMEOUT_SECONDS", "300"))
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "8"))
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "200"))
+
+JOB_FUNCTIONS = {
+    "rfm": compute_rfm_segmentation,
+    "rfm_scalable": compute_rfm_scalable,
+    "forecast": compute_sales_predictions,
+    "series_forecast": run_forecasts,
+}
+
+def _worker_loop(conn):
+    """Boucle d'un processus de calcul : reçoit un type de job, renvoie (succès, résultat ou message)"""
+    # Groupe de processus propre : un arrêt tue aussi le pool d'ajustement des prévisions qu'il a lancé
+    os.setsid()
+    while True:
+        try:
+            job_type, params = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send((True, JOB_FUNCTIONS[job_type](**params)))
+        except HTTPException as e:
+            # Code HTTP conservé : une requête invalide détectée dans le job reste une erreur 4xx
+            conn.send((False, (e.status_code, e.detail)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+class JobTimeout(Exception):
+    pass
+
+class WorkerProcess:
+    """Processus de calcul persistant (modules déjà importés) ; tué et relancé si un job dépasse son délai.
+
+    Non « daemon » pour pouvoir héberger le pool d'ajustement des prévisions : il est tué avec tout
+    son groupe de processus (pool compris) en cas de délai dépassé et à la sortie de l'interpréteur.
+    """
+
+    def __init__(self):
+        self.context = multiprocessing.get_context("spawn")
+        self.process = None
+        self.conn = None
+
+    def start(self):
+        self.conn, child = self.context.Pipe()
+        self.process = self.context.Process(target=_worker_loop, args=(child,))
+        self.process.start()
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            # Processus pas encore passé dans son propre groupe (ou déjà terminé)
+            self.process.kill()
+        self.process.join()
+        self.process = None
+
+    def stop(self):
+        if self.process is not None:
+            self.kill()
+
+    def run(self, job_type, params, timeout):
+        if self.process is None or not self.process.is_alive():
+            self.start()
+        self.conn.send((job_type, params))
+        if not self.conn.poll(timeout):
+            self.kill()
+            raise JobTimeout(f"Délai dépassé ({timeout:.0f}s)")
+        return self.conn.recv()
+
+class JobManager:
+    """File bornée + JOB_WORKERS threads, chacun pilotant son propre processus de calcul"""
+
+    def __init__(self, workers, max_queue, retention):
+        self.workers = workers
+        self.pending = queue.Queue(maxsize=max_queue)
+        self.retention = retention
+        self.jobs = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.started = False
+
+    def _start(self):
+        # Démarrage paresseux : les processus « spawn » réimportent ce module sans relancer de pool
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        processes = [WorkerProcess() for _ in range(self.workers)]
+        # Enregistré après l'import de multiprocessing : exécuté avant son attente des processus enfants
+        atexit.register(lambda: [worker.stop() for worker in processes])
+        for worker in processes:
+            threading.Thread(target=self._runner, args=(worker,), daemon=True).start()
+
+    def submit(self, job_type, params=None):
+        params = params or {}
+        job = {
+            "id": uuid.uuid4().hex, "type": job_type, "params": params, "status": "queued",
+            "submitted_at": datetime.utcnow().isoformat(), "started_at": None, "finished_at": None,
+            "duration_s": None, "cached": False, "result": None, "error": None,
+        }
+        job["_done"] = threading.Event()
+        key = job["_key"] = cache_key(job_type, params)
+        with self.lock:
+            # Coalescence : une demande identique déjà en file ou en cours est partagée, pas relancée
+            running = self.inflight.get(key) if key else None
+        if running is not None:
+            result_cache.peek(key, coalesced=True)
+            return running
+        cached_result = result_cache.peek(key) if key else None
+        if cached_result is not None:
+            # Résultat déjà calculé pour cette version du Data Warehouse : aucun ajustement
+            self._finish(job, "done", result=cached_result)
+            job["cached"] = True
+        else:
+            self._start()
+            with self.lock:
+                if key:
+                    if key in self.inflight:
+                        return self.inflight[key]
+                    self.inflight[key] = job
+                try:
+                    self.pending.put_nowait(job)
+                except queue.Full:
+                    self.inflight.pop(key, None)
+                    raise HTTPException(status_code=429, detail="File d'attente des jobs pleine, réessayez plus tard")
+        with self.lock:
+            self.jobs[job["id"]] = job
+            while len(self.jobs) > self.retention:
+                self.jobs.popitem(last=False)
+        return job
+
+    def _finish(self, job, status, result=None, error=None):
+        job.update(status=status, result=result, error=error, finished_at=datetime.utcnow().isoformat())
+        if job["started_at"]:
+            job["duration_s"] = round(time.monotonic() - job["_started"], 3)
+        with self.lock:
+            if job["_key"] and self.inflight.get(job["_key"]) is job:
+                del self.inflight[job["_key"]]
+        job["_done"].set()
+
+    def _runner(self, worker):
+        while True:
+            job = self.pending.get()
+            job["status"] = "running"
+            job["started_at"] = datetime.utcnow().isoformat()
+            job["_started"] = time.monotonic()
+            try:
+                ok, payload = worker.run(job["type"], job["params"], JOB_TIMEOUT_SECONDS)
+            except JobTimeout as e:
+                self._finish(job, "timeout", error=str(e))
+                continue
+            except Exception as e:
+                self._finish(job, "failed", error=f"Processus de calcul perdu : {e}")
+                continue
+            if ok:
+                if job["_key"]:
+                    result_cache.put(job["_key"], payload)
+                self._finish(job, "done", result=payload)
+            else:
+                status_code, error = payload if isinstance(payload, tuple) else (500, payload)
+                job["_status_code"] = status_code
+                self._finish(job, "failed", error=error)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def stats(self):
+        with self.lock:
+            statuses = [j["status"] for j in self.jobs.values()]
+        return {"workers": self.workers, "queue_depth": self.pending.qsize(), "max_queue": self.pending.maxsize,
+                **{status: statuses.count(status) for status in ("queued", "running", "done", "failed", "timeout")}}
+
+job_manager = JobManager(JOB_WORKERS, JOB_MAX_QUEUE, JOB_RETENTION)
+
+def cache_key(job_type, params):
+    version = warehouse_version() if ANALYTICS_CACHE_ENABLED else None
+    return (job_type, tuple(sorted(params.items())), version) if version is not None else None
+
+def public_job(job):
+    public = {k: v for k, v in job.items() if not k.startswith("_")}
+    # Résultats tabulaires (DataFrame) : formats négociés sur /mining/*, lignes JSON ici
+    result = public["result"]
+    if isinstance(result, pd.DataFrame):
+        public["result"] = result.to_dict(orient="records")
+    elif isinstance(result, dict) and any(isinstance(v, pd.DataFrame) for v in result.values()):
+        public["result"] = {k: v.to_dict(orient="records") if isinstance(v, pd.DataFrame) else v for k, v in result.items()}
+    return public
+
+def run_job_and_wait(job_type, params=None):
+    """Variante synchrone des endpoints historiques : même pool, le thread attend sans tenir le GIL"""
+    job = job_manager.submit(job_type, params)
+    job["_done"].wait()
+    if job["status"] == "done":
+        return job["result"]
+    if 400 <= job.get("_status_code", 500) < 500:
+        raise HTTPException(job["_status_code"], job["error"])
+    raise HTTPException(504 if job["status"] == "timeout" else 500, f"Erreur {job_type}: {job['error']}")
+
+@app.post("/jobs/rfm", status_code=202)
+def submit_rfm_job(mode: Literal["kmeans", "scalable"] = "kmeans"):
+    return public_job(job_manager.submit("rfm_scalable" if mode == "scalable" else "rfm"))
+
+@app.post("/jobs/forecast", status_code=202)
+def submit_forecast_job():
+    return public_job(job_manager.submit("forecast"))
+
+@app.get("/jobs/stats")
+def get_job_stats():
+    return job_manager.stats()
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job introuvable")
+    return public_job(job)
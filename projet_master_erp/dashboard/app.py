@@ -1,49 +1,181 @@
 import streamlit as st
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 import plotly.express as px
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # --- LIAISON AVEC LE DOCKER-COMPOSE ---
 ANALYTICS_API_URL = os.getenv("ANALYTICS_API_URL", "http://analytics:8001")
 HF_TOKEN = os.getenv("HF_TOKEN", "")
 HF_API_URL = "https://router.huggingface.co/v1/chat/completions"
 
+# Durée pendant laquelle une réponse est servie sans aucun appel ; au-delà, revalidation par ETag
+# (304 sans transfert tant que l'ETL n'a pas publié de nouvelle version du Data Warehouse)
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "30"))
+# (connexion, lecture) : les calculs de mining peuvent prendre plusieurs dizaines de secondes
+ANALYTICS_TIMEOUT = (float(os.getenv("ANALYTICS_CONNECT_TIMEOUT", "3")), float(os.getenv("ANALYTICS_READ_TIMEOUT", "120")))
+
 st.set_page_config(page_title="Dashboard Décisionnel - Groupe 4", layout="wide")
 
+# --- ACCÈS À L'ANALYTICS (session keep-alive, cache ETag partagé entre les sessions Streamlit) ---
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class AnalyticsCache:
+    """Réponses JSON par URL : servies telles quelles pendant le TTL, puis revalidées via If-None-Match"""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def fetch(self, path, params=None):
+        key = (path, tuple(sorted((params or {}).items())))
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and time.monotonic() - entry["checked_at"] < DASHBOARD_CACHE_TTL:
+            return entry["data"]
+        headers = {"If-None-Match": entry["etag"]} if entry and entry["etag"] else {}
+        res = get_http_session().get(f"{ANALYTICS_API_URL}{path}", params=params, headers=headers,
+                                     timeout=ANALYTICS_TIMEOUT)
+        if res.status_code == 304 and entry:
+            data = entry["data"]
+        else:
+            res.raise_for_status()
+            data = res.json()
+        with self.lock:
+            self.entries[key] = {"data": data, "etag": res.headers.get("ETag"), "checked_at": time.monotonic()}
+        return data
+
+@st.cache_resource
+def get_analytics_cache():
+    return AnalyticsCache()
+
+@st.cache_resource
+def get_prefetch_pool():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+
+def fetch_analytics(path, params=None):
+    return get_analytics_cache().fetch(path, params)
+
+# Onglet RFM : carte de densité agrégée côté serveur (par défaut) ou liste complète des clients
+RFM_DENSITY_MODE = "Carte de densité (agrégée)"
+RFM_DETAIL_MODE = "Détail (tous les clients)"
+RFM_DENSITY_BINS = int(os.getenv("RFM_DENSITY_BINS", "40"))
+RFM_DENSITY_POINTS = int(os.getenv("RFM_DENSITY_POINTS", "2000"))
+SEGMENT_COLORS = {"VIP": "green", "Occasionnels": "blue", "À risque": "red"}
+
+# Pré-chargement dès l'affichage de la page des seuls endpoints peu coûteux (KPI lus dans un mart) ;
+# les résultats de data mining (RFM, densité, ARIMA) ne sont demandés qu'à l'ouverture de leur onglet
+density_params = {"bins": RFM_DENSITY_BINS, "max_points": RFM_DENSITY_POINTS}
+PREFETCH = {"kpis": ("/kpis", None)}
+prefetched = {name: get_prefetch_pool().submit(fetch_analytics, path, params) for name, (path, params) in PREFETCH.items()}
+
 st.title("📊 ERP & BI : Pilotage Décisionnel Intelligent")
 st.markdown("*Distribution Commerciale - Master 1 (Groupe 4)*")
 
 tab1, tab2, tab3 = st.tabs(["👥 Segmentation Client (RFM)", "📈 Prédictions des Ventes (ARIMA)", "🤖 Reporting IA (NLG)"])
 
 # --- ONGLET 1 : DATA MINING (RFM) ---
+def render_rfm_density():
+    """Carte de densité R × F par segment + échantillon WebGL, puis exploration d'une cellule"""
+    # Carte et échantillon demandés en parallèle
+    density = get_prefetch_pool().submit(fetch_analytics, "/mining/rfm/density", density_params)
+    samples = get_prefetch_pool().submit(fetch_analytics, "/mining/rfm/density/samples", density_params)
+    try:
+        density, samples = density.result(), samples.result()
+    except requests.RequestException:
+        st.error("Erreur de connexion au service Analytics.")
+        return
+    if "cells" not in density:
+        st.warning(density.get("status", "Segmentation indisponible."))
+        return
+    cells = pd.DataFrame(density["cells"])
+    st.caption(f"{density['total_clients']} clients résumés en {len(cells)} cellules "
+               f"et {len(samples['samples'])} points représentatifs.")
+
+    # Centre de chaque cellule, en coordonnées de données (la fréquence est découpée en échelle log)
+    cells["recence"] = (cells["recence_min"] + cells["recence_max"] - 1) / 2
+    cells["frequence"] = (cells["frequence_min"] + cells["frequence_max"] - 1) / 2
+    fig = px.density_heatmap(cells, x="recence", y="frequence", z="nb_clients", histfunc="sum",
+                             facet_col="segment", nbinsx=RFM_DENSITY_BINS, nbinsy=RFM_DENSITY_BINS,
+                             log_y=True, title="Densité des clients par segment (récence × fréquence)")
+    st.plotly_chart(fig, use_container_width=True)
+
+    points = pd.DataFrame(samples["samples"])
+    fig = px.scatter(points, x="recence", y="frequence", size="montant_total", color="segment", log_y=True,
+                     render_mode="webgl", color_discrete_map=SEGMENT_COLORS,
+                     title="Échantillon représentatif des segments (VIP vs Risque)")
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.subheader("Exploration d'une cellule")
+    cells = cells.sort_values("nb_clients", ascending=False).reset_index(drop=True)
+    choice = st.selectbox(
+        "Cellule", cells.index,
+        format_func=lambda i: (f"{cells.at[i, 'segment']} · récence {cells.at[i, 'recence_min']}-{cells.at[i, 'recence_max'] - 1} j"
+                               f" · fréquence {cells.at[i, 'frequence_min']}-{cells.at[i, 'frequence_max'] - 1}"
+                               f" · {cells.at[i, 'nb_clients']} clients"))
+    cell = cells.loc[choice]
+    try:
+        page = fetch_analytics("/mining/rfm/clients", {
+            "segment": cell["segment"], "limit": 200,
+            "recence_min": int(cell["recence_min"]), "recence_max": int(cell["recence_max"]),
+            "frequence_min": int(cell["frequence_min"]), "frequence_max": int(cell["frequence_max"]),
+        })
+        st.dataframe(pd.DataFrame(page["items"]))
+        if page["next_after"] is not None:
+            st.caption("200 premiers clients de la cellule affichés.")
+    except requests.RequestException:
+        st.error("Erreur de connexion au service Analytics.")
+
 with tab1:
     st.header("Analyse RFM & Clustering K-Means")
+    # La liste complète (coûteuse) n'est chargée qu'en mode détail, à la demande
+    mode = st.radio("Affichage", [RFM_DENSITY_MODE, RFM_DETAIL_MODE], key="rfm_mode", horizontal=True)
     if st.button("Lancer la segmentation"):
         with st.spinner("Calcul des clusters en cours..."):
-            res = requests.get(f"{ANALYTICS_API_URL}/mining/rfm")
-            if res.status_code == 200:
-                data = res.json()
-                if isinstance(data, dict) and "status" in data:
-                    st.warning(data["status"])
-                else:
-                    df = pd.DataFrame(data)
-                    st.dataframe(df)
-                    fig = px.scatter(df, x="recence", y="frequence", size="montant_total", color="segment",
-                                     title="Répartition des Segments Clients (VIP vs Risque)",
-                                     color_discrete_map={"VIP": "green", "Occasionnels": "blue", "À risque": "red"})
-                    st.plotly_chart(fig, use_container_width=True)
+            if mode == RFM_DENSITY_MODE:
+                st.session_state["rfm_density_shown"] = True
             else:
-                st.error("Erreur de connexion au service Analytics.")
+                try:
+                    data = fetch_analytics("/mining/rfm")
+                except requests.RequestException:
+                    data = None
+                if data is not None:
+                    if isinstance(data, dict) and "status" in data:
+                        st.warning(data["status"])
+                    else:
+                        df = pd.DataFrame(data)
+                        st.dataframe(df)
+                        fig = px.scatter(df, x="recence", y="frequence", size="montant_total", color="segment",
+                                         title="Répartition des Segments Clients (VIP vs Risque)",
+                                         render_mode="webgl", color_discrete_map=SEGMENT_COLORS)
+                        st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.error("Erreur de connexion au service Analytics.")
+    # La carte reste affichée pendant l'exploration (chaque choix de cellule relance le script)
+    if mode == RFM_DENSITY_MODE and st.session_state.get("rfm_density_shown"):
+        with st.spinner("Calcul des clusters en cours..."):
+            render_rfm_density()
 
 # --- ONGLET 2 : PRÉDICTIONS (ARIMA) ---
 with tab2:
     st.header("Prédiction des Ventes sur 3 Mois")
     if st.button("Lancer les prédictions (ARIMA)"):
         with st.spinner("Modélisation des séries temporelles..."):
-            res = requests.get(f"{ANALYTICS_API_URL}/mining/predictions")
-            if res.status_code == 200:
-                data = res.json()
+            try:
+                data = fetch_analytics("/mining/predictions")
+            except requests.RequestException:
+                data = None
+            if data is not None:
                 if data.get("status") == "mock":
                     st.info(data["message"])
                 
@@ -65,10 +197,12 @@ with tab3:
     if st.button("🤖 Générer le Rapport Mensuel"):
         with st.spinner("Analyse des données en cours..."):
             try:
-                # 1. Récupération des vrais chiffres depuis votre base de données
-                kpi_res = requests.get(f"{ANALYTICS_API_URL}/kpis")
-                if kpi_res.status_code == 200:
-                    kpis = kpi_res.json()
+                # 1. Récupération des vrais chiffres (KPI déjà pré-chargés et mis en cache)
+                try:
+                    kpis = prefetched["kpis"].result()
+                except requests.RequestException:
+                    kpis = None
+                if kpis is not None:
                     ca = kpis.get("ca_total", 0)
                     marge = kpis.get("marge_totale", 0)
 
@@ -0,0 +1,301 @@
+"""Générateur de données synthétiques pour les tests de charge de l'ERP.
+
+Produit des clients, produits, commandes, lignes et mouvements de stock en volume
+(plusieurs millions de lignes) avec des distributions réalistes :
+- popularité des produits en loi de Zipf, activité des clients en loi de Pareto ;
+- saisonnalité annuelle, pic de fin d'année, effet jour de la semaine et tendance ;
+- graine fixe : deux exécutions avec les mêmes paramètres (graine, date de fin, id de départ)
+  donnent les mêmes données, quels que soient le jour d'exécution et le contenu de la base.
+
+Le chargement se fait par blocs via COPY FROM STDIN (PostgreSQL), ou INSERT multi-lignes
+sur les autres bases (SQLite pour les tests locaux).
+
+Usage :
+    python datagen.py --clients 1000000 --products 50000 --orders 5000000 --seed 42
+    python datagen.py --orders 100000 --end-date 2025-06-30 --id-offset 10000000
+"""
+import argparse
+import bisect
+import csv
+import io
+import math
+import os
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, text
+
+COLUMNS = {
+    "clients": ["id", "name", "email", "phone", "credit_limit", "current_debt", "is_vip"],
+    "products": ["id", "sku", "name", "price", "purchase_price", "stock_quantity", "safety_stock"],
+    "orders": ["id", "client_id", "total_amount", "status", "created_at", "created_by_id", "validated_at"],
+    "order_items": ["id", "order_id", "product_id", "quantity", "unit_price", "discount_applied"],
+    "stock_movements": ["id", "product_id", "quantity", "movement_type", "timestamp", "user_id"],
+}
+
+CATEGORIES = ["Informatique", "Téléphonie", "Audio", "Bureautique", "Électroménager", "Accessoires"]
+WEEKDAY_FACTOR = [1.0, 0.95, 1.0, 1.05, 1.15, 1.3, 0.6]  # lundi -> dimanche
+ITEMS_PER_ORDER = [1, 2, 3, 4, 5, 6]
+ITEMS_WEIGHTS = [40, 25, 15, 10, 6, 4]
+QUANTITIES = [1, 2, 3, 4, 5, 8, 10, 20]
+QUANTITY_WEIGHTS = [45, 20, 12, 8, 6, 4, 3, 2]
+# Fin d'historique par défaut, fixe : la date du jour rendrait chaque exécution différente
+DEFAULT_END_DATE = date(2025, 1, 1)
+
+
+class TableLoader:
+    """Chargement par blocs : COPY FROM STDIN sous PostgreSQL, INSERT multi-lignes sinon"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.use_copy = engine.dialect.name == "postgresql"
+
+    def load(self, conn, table, rows):
+        if not rows:
+            return
+        columns = COLUMNS[table]
+        if self.use_copy:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            with conn.connection.cursor() as cur:
+                cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        else:
+            placeholders = ", ".join(f":{c}" for c in columns)
+            conn.execute(
+                text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"),
+                [dict(zip(columns, row)) for row in rows],
+            )
+
+    def reset_sequences(self, conn):
+        if self.use_copy:
+            for table in COLUMNS:
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 1))"
+                ))
+
+
+def _cumulative(weights):
+    total, cum = 0.0, []
+    for w in weights:
+        total += w
+        cum.append(total)
+    return cum
+
+
+def _pick(rng, cum):
+    return bisect.bisect_right(cum, rng.random() * cum[-1])
+
+
+def day_weights(start, days):
+    """Poids de chaque jour : saisonnalité + pic de novembre/décembre + jour de semaine + tendance"""
+    weights = []
+    for d in range(days):
+        day = start + timedelta(days=d)
+        doy = day.timetuple().tm_yday
+        seasonal = 1 + 0.25 * math.sin(2 * math.pi * (doy - 80) / 365.25)
+        if day.month == 12:
+            seasonal *= 1.6 if day.day <= 24 else 1.2
+        elif day.month == 11 and day.day >= 20:
+            seasonal *= 1.4
+        trend = 1 + 0.3 * d / max(days - 1, 1)
+        weights.append(seasonal * WEEKDAY_FACTOR[day.weekday()] * trend)
+    return weights
+
+
+def check_params(clients, products, orders, days, chunk_size, vip_ratio, validated_ratio, id_offset):
+    """Refuse les volumes non positifs avant tout chargement (sinon IndexError/ValueError en plein COPY)"""
+    sizes = {"clients": clients, "products": products, "orders": orders, "days": days, "chunk_size": chunk_size}
+    invalid = {name: value for name, value in sizes.items() if value < 1}
+    if invalid:
+        raise ValueError(f"Volumes strictement positifs attendus : {invalid}")
+    for name, value in (("vip_ratio", vip_ratio), ("validated_ratio", validated_ratio)):
+        if not 0 <= value <= 1:
+            raise ValueError(f"{name} doit être compris entre 0 et 1 (reçu : {value})")
+    if id_offset is not None and id_offset < 0:
+        raise ValueError(f"id_offset doit être positif ou nul (reçu : {id_offset})")
+
+def generate_dataset(engine, clients=10000, products=1000, orders=100000, days=730, seed=42,
+                     chunk_size=50000, vip_ratio=0.08, validated_ratio=0.9, end_date=DEFAULT_END_DATE,
+                     id_offset=None, progress=None):
+    """Génère et charge un jeu de données complet. Retourne les volumes et la durée.
+
+    Les ids commencent à `id_offset` + 1 dans chaque table ; par défaut, après le plus grand id
+    existant (les ids, et les noms, SKU et e-mails qui en dérivent, dépendent alors de la base).
+    """
+    check_params(clients, products, orders, days, chunk_size, vip_ratio, validated_ratio, id_offset)
+    rng = random.Random(seed)
+    loader = TableLoader(engine)
+    end_date = datetime(end_date.year, end_date.month, end_date.day)
+    start_date = end_date - timedelta(days=days)
+    started = time.perf_counter()
+    counts = dict.fromkeys(COLUMNS, 0)
+
+    def report(msg):
+        if progress:
+            progress(msg)
+
+    with engine.begin() as conn:
+        user_id = conn.execute(text("SELECT MIN(id) FROM users")).scalar()
+        if user_id is None:
+            conn.execute(text("INSERT INTO users (username, role) VALUES ('admin', 'admin')"))
+            user_id = conn.execute(text("SELECT MIN(id) FROM users")).scalar()
+        offsets = {t: conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {t}")).scalar() for t in COLUMNS}
+    if id_offset is not None:
+        taken = {t: offset for t, offset in offsets.items() if offset > id_offset}
+        if taken:
+            raise ValueError(f"id_offset={id_offset} chevauche des ids existants : {taken}")
+        offsets = dict.fromkeys(COLUMNS, id_offset)
+
+    # 1. Produits (popularité en loi de Zipf, rangs mélangés pour ne pas corréler id et ventes)
+    product_ids, prices, costs = [], [], []
+    ranks = list(range(1, products + 1))
+    rng.shuffle(ranks)
+    popularity = _cumulative([1 / r ** 1.1 for r in ranks])
+    for start in range(0, products, chunk_size):
+        rows = []
+        for i in range(start, min(start + chunk_size, products)):
+            pid = offsets["products"] + i + 1
+            price = round(min(rng.lognormvariate(math.log(80), 1.0), 20000), 2)
+            cost = round(price * rng.uniform(0.55, 0.85), 2)
+            rows.append((pid, f"GEN-{pid:08d}", f"{rng.choice(CATEGORIES)} {pid}", price, cost,
+                         rng.randint(500, 50000), rng.randint(5, 50)))
+            product_ids.append(pid)
+            prices.append(price)
+            costs.append(cost)
+        with engine.begin() as conn:
+            loader.load(conn, "products", rows)
+        counts["products"] += len(rows)
+    report(f"{counts['products']} produits chargés")
+
+    # 2. Clients (activité en loi de Pareto : quelques gros clients, une longue traîne)
+    client_ids, vip_flags, activity = [], [], []
+    for start in range(0, clients, chunk_size):
+        rows = []
+        for i in range(start, min(start + chunk_size, clients)):
+            cid = offsets["clients"] + i + 1
+            is_vip = rng.random() < vip_ratio
+            rows.append((cid, f"Client Généré {cid}", f"gen_{cid}@load.test", f"GEN{cid:010d}",
+                         50000.0 if is_vip else 10000.0, 0.0, is_vip))
+            client_ids.append(cid)
+            vip_flags.append(is_vip)
+            activity.append(rng.paretovariate(1.2) * (3 if is_vip else 1))
+        with engine.begin() as conn:
+            loader.load(conn, "clients", rows)
+        counts["clients"] += len(rows)
+    activity = _cumulative(activity)
+    report(f"{counts['clients']} clients chargés")
+
+    # 3. Commandes, lignes et sorties de stock, générées et chargées bloc par bloc
+    calendar = _cumulative(day_weights(start_date, days))
+    item_cum = _cumulative(ITEMS_WEIGHTS)
+    qty_cum = _cumulative(QUANTITY_WEIGHTS)
+    next_item_id = offsets["order_items"]
+    next_movement_id = offsets["stock_movements"]
+    for start in range(0, orders, chunk_size):
+        order_rows, item_rows, movement_rows = [], [], []
+        for i in range(start, min(start + chunk_size, orders)):
+            oid = offsets["orders"] + i + 1
+            c = _pick(rng, activity)
+            created_at = start_date + timedelta(days=_pick(rng, calendar), seconds=rng.randint(8 * 3600, 20 * 3600))
+            status = "VALIDATED" if rng.random() < validated_ratio else "PENDING"
+            # Jamais dans le futur : l'ETL incrémental utilise validated_at comme watermark
+            validated_at = min(created_at + timedelta(hours=rng.randint(1, 48)), end_date) if status == "VALIDATED" else None
+            discount = 0.10 if vip_flags[c] else 0.0
+            total = 0.0
+            for _ in range(ITEMS_PER_ORDER[_pick(rng, item_cum)]):
+                p = _pick(rng, popularity)
+                qty = QUANTITIES[_pick(rng, qty_cum)]
+                unit_price = round(prices[p] * (1 - discount), 2)
+                next_item_id += 1
+                item_rows.append((next_item_id, oid, product_ids[p], qty, unit_price, discount))
+                total += unit_price * qty
+                if status == "VALIDATED":
+                    next_movement_id += 1
+                    movement_rows.append((next_movement_id, product_ids[p], qty, "OUT", validated_at, user_id))
+            order_rows.append((oid, client_ids[c], round(total, 2), status, created_at, user_id, validated_at))
+
+        with engine.begin() as conn:
+            loader.load(conn, "orders", order_rows)
+            loader.load(conn, "order_items", item_rows)
+            loader.load(conn, "stock_movements", movement_rows)
+        counts["orders"] += len(order_rows)
+        counts["order_items"] += len(item_rows)
+        counts["stock_movements"] += len(movement_rows)
+        report(f"{counts['orders']}/{orders} commandes chargées")
+
+    # 4. Réapprovisionnements (entrées de stock) : environ un par produit et par mois
+    restocks = max(days // 30, 1)
+    for start in range(0, products, chunk_size):
+        rows = []
+        for p in range(start, min(start + chunk_size, products)):
+            for _ in range(restocks):
+                next_movement_id += 1
+                rows.append((next_movement_id, product_ids[p], rng.randint(50, 1000), "IN",
+                             start_date + timedelta(days=rng.randint(0, days - 1), hours=rng.randint(6, 10)), user_id))
+        with engine.begin() as conn:
+            loader.load(conn, "stock_movements", rows)
+        counts["stock_movements"] += len(rows)
+
+    with engine.begin() as conn:
+        loader.reset_sequences(conn)
+
+    duration = time.perf_counter() - started
+    total_rows = sum(counts.values())
+    return {
+        "rows": counts,
+        "seed": seed,
+        "id_offsets": offsets,
+        "period": [start_date.date().isoformat(), end_date.date().isoformat()],
+        "duration_s": round(duration, 2),
+        "rows_per_s": round(total_rows / duration) if duration else total_rows,
+    }
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"entier strictement positif attendu : {value}")
+    return number
+
+def non_negative_int(value):
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"entier positif ou nul attendu : {value}")
+    return number
+
+def ratio(value):
+    number = float(value)
+    if not 0 <= number <= 1:
+        raise argparse.ArgumentTypeError(f"proportion entre 0 et 1 attendue : {value}")
+    return number
+
+def main():
+    parser = argparse.ArgumentParser(description="Générateur de données de charge pour l'ERP")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "postgresql://admin:password@db/erp_db"))
+    parser.add_argument("--clients", type=positive_int, default=10000)
+    parser.add_argument("--products", type=positive_int, default=1000)
+    parser.add_argument("--orders", type=positive_int, default=100000)
+    parser.add_argument("--days", type=positive_int, default=730, help="Profondeur d'historique en jours")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=positive_int, default=50000)
+    parser.add_argument("--vip-ratio", type=ratio, default=0.08)
+    parser.add_argument("--validated-ratio", type=ratio, default=0.9)
+    parser.add_argument("--end-date", type=date.fromisoformat, default=DEFAULT_END_DATE,
+                        help="Dernier jour d'historique (AAAA-MM-JJ)")
+    parser.add_argument("--id-offset", type=non_negative_int, default=None,
+                        help="Ids générés à partir de id_offset + 1 (défaut : après le plus grand id existant)")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    result = generate_dataset(
+        engine, clients=args.clients, products=args.products, orders=args.orders, days=args.days,
+        seed=args.seed, chunk_size=args.chunk_size, vip_ratio=args.vip_ratio,
+        validated_ratio=args.validated_ratio, end_date=args.end_date, id_offset=args.id_offset, progress=lambda msg: print(f"⏳ {msg}"),
+    )
+    print(f"✅ Génération terminée : {result}")
+
+
+if __name__ == "__main__":
+    main()
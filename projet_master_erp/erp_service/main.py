@@ -1,33 +1,136 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Boolean
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from datetime import datetime, timedelta
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Index, insert, inspect, select, tuple_, update, event, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker, declarative_base, relationship, joinedload
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, Histogram, generate_latest
+from collections import OrderedDict, namedtuple
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta
+from typing import Literal, Optional
+import asyncio
+import base64
+import json
 import os
 import time
 import random
+import queue
+import threading
+from select import select as select_fds
+
+from datagen import DEFAULT_END_DATE, generate_dataset
 
 # --- CONFIGURATION BDD ---
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://admin:password@db/erp_db")
 
-def wait_for_db():
-    retries = 0
-    while retries < 30:
+# Mode asynchrone (SQLAlchemy asyncio + asyncpg) pour les endpoints de commandes
+ASYNC_DB_ENABLED = os.getenv("ASYNC_DB_ENABLED", "0") == "1"
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (
+    DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1).replace("sqlite://", "sqlite+aiosqlite://", 1)
+)
+
+# Pool de connexions (par worker) et garde-fous
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+DB_CONNECT_RETRIES = int(os.getenv("DB_CONNECT_RETRIES", "30"))
+
+# Temps d'attente pour obtenir une connexion du pool (pool saturé = requêtes en file)
+POOL_CHECKOUT_WAIT = Histogram(
+    "erp_db_pool_checkout_wait_seconds", "Attente pour obtenir une connexion du pool", ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+class TimedQueuePool(QueuePool):
+    metrics_label = "sync"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.labels(self.metrics_label).observe(time.perf_counter() - started)
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    metrics_label = "async"
+
+    def _do_get(self):
+        started = time.perf_counter()
         try:
-            engine = create_engine(DATABASE_URL)
-            with engine.connect() as conn:
-                pass
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.labels(self.metrics_label).observe(time.perf_counter() - started)
+
+def engine_options(url, is_async=False):
+    """Options du moteur SQLAlchemy construites à partir des variables d'environnement"""
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if url.startswith("sqlite"):
+        options["connect_args"] = {"check_same_thread": False}
+        return options
+
+    options.update(poolclass=TimedAsyncQueuePool if is_async else TimedQueuePool,
+                   pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                   pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE)
+    if DB_STATEMENT_TIMEOUT_MS:
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+class ERPSession(Session):
+    """Session commune aux modes sync et async (porte les hooks after_commit / after_rollback)"""
+
+# Le moteur synchrone reste toujours disponible : tâches de fond (journal, cache) et endpoints de seed
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+SessionLocal = sessionmaker(bind=engine, class_=ERPSession, expire_on_commit=False)
+
+def make_async_engine():
+    """Moteur asyncio si activé ; repli sur le pool de threads si le pilote async (asyncpg/aiosqlite) est absent"""
+    if not ASYNC_DB_ENABLED:
+        return None
+    try:
+        return create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, is_async=True))
+    except ImportError as e:
+        print(f"⚠️ Pilote asynchrone indisponible ({e}), repli sur le mode synchrone (pool de threads)")
+        return None
+
+async_engine = make_async_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, sync_session_class=ERPSession, expire_on_commit=False) if async_engine is not None else None
+
+async def run_db(fn, *args):
+    """Exécute fn(session, *args) sur le moteur asyncio, ou dans le pool de threads en mode synchrone"""
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as session:
+            return await session.run_sync(fn, *args)
+
+    def call():
+        with SessionLocal() as session:
+            return fn(session, *args)
+    return await run_in_threadpool(call)
+
+async def wait_for_db():
+    """Attente de la BDD au démarrage (sans bloquer l'import ni recréer de moteur à chaque essai)"""
+    for _ in range(DB_CONNECT_RETRIES):
+        try:
+            await run_in_threadpool(lambda: engine.connect().close())
+            if async_engine is not None:
+                async with async_engine.connect():
+                    pass
             print("✅ BDD Connectée.")
-            return engine
-        except:
+            return
+        except Exception:
             print("⏳ Attente BDD...")
-            time.sleep(2)
-            retries += 1
+            await asyncio.sleep(2)
     raise Exception("Erreur connexion BDD")
 
-engine = wait_for_db()
-SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
-
 Base = declarative_base()
 
 # --- 1. MODÈLES DE DONNÉES (SQLAlchemy) ---
@@ -64,24 +167,28 @@ class Order(Base):
     """Module Ventes & Facturation"""
     __tablename__ = "orders"
     id = Column(Integer, primary_key=True, index=True)
-    client_id = Column(Integer, ForeignKey("clients.id"))
+    client_id = Column(Integer, ForeignKey("clients.id"), index=True)
     total_amount = Column(Float, default=0.0)
     status = Column(String, default="PENDING")
     created_at = Column(DateTime, default=datetime.utcnow)
     created_by_id = Column(Integer, ForeignKey("users.id"))
+    validated_at = Column(DateTime, nullable=True, index=True)  # Watermark de l'ETL incrémental
     
     items = relationship("OrderItem", back_populates="order")
 
+    __table_args__ = (Index("ix_orders_status_created_at", "status", "created_at"),)
+
 class OrderItem(Base):
     __tablename__ = "order_items"
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"))
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
     quantity = Column(Integer)
     unit_price = Column(Float)
     discount_applied = Column(Float, default=0.0)
     
     order = relationship("Order", back_populates="items")
+    product = relationship("Product")
 
 class StockMovement(Base):
     """Traçabilité des mouvements de stock"""
@@ -93,6 +200,8 @@ class StockMovement(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
     user_id = Column(Integer, ForeignKey("users.id"))
 
+    __table_args__ = (Index("ix_stock_movements_product_timestamp", "product_id", "timestamp"),)
+
 class AuditLog(Base):
     """Journalisation et traçabilité"""
     __tablename__ = "audit_logs"
@@ -102,12 +211,483 @@ class AuditLog(Base):
     user_id = Column(Integer, nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
-Base.metadata.create_all(bind=engine)
-app = FastAPI(title="ERP Distribution (SOA)", version="3.0")
+def create_schema(bind):
+    """create_all ne crée que les tables absentes : on ajoute aussi colonnes (nullables) et index manquants"""
+    Base.metadata.create_all(bind=bind)
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(bind.dialect)}"))
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
+
+@asynccontextmanager
+async def lifespan(app):
+    await wait_for_db()
+    await run_in_threadpool(create_schema, engine)
+    if CATALOG_CACHE_ENABLED and engine.dialect.name == "postgresql":
+        threading.Thread(target=listen_catalog_invalidations, daemon=True).start()
+    if AUDIT_BUFFER_ENABLED:
+        audit_writer.start()
+    yield
+    audit_writer.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
+    engine.dispose()
+
+app = FastAPI(title="ERP Distribution (SOA)", version="3.0", lifespan=lifespan)
+
+# --- OBSERVABILITÉ : LATENCES, SQL PAR REQUÊTE & POOL (format Prometheus sur /metrics) ---
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # 0 = journal des requêtes lentes désactivé
+
+REQUEST_LATENCY = Histogram(
+    "erp_request_duration_seconds", "Latence des requêtes HTTP par endpoint", ["method", "route", "status"],
+)
+SQL_STATEMENTS_PER_REQUEST = Histogram(
+    "erp_sql_statements_per_request", "Nombre de requêtes SQL exécutées par requête HTTP", ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233, 377, 610, 1000),
+)
+SQL_TIME_PER_REQUEST = Histogram(
+    "erp_sql_duration_seconds_per_request", "Temps passé en SQL par requête HTTP", ["method", "route"],
+)
+POOL_CHECKED_OUT = Gauge("erp_db_pool_checked_out", "Connexions actuellement empruntées au pool", ["engine"])
+POOL_SIZE = Gauge("erp_db_pool_size", "Taille nominale du pool", ["engine"])
+POOL_OVERFLOW = Gauge("erp_db_pool_overflow", "Connexions en débordement (max_overflow)", ["engine"])
+
+class RequestStats:
+    __slots__ = ("statements", "sql_time", "queries")
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_time = 0.0
+        self.queries = []
+
+# Objet mutable partagé par la requête, y compris dans le pool de threads et les greenlets run_sync
+request_stats = ContextVar("request_stats", default=None)
+
+def instrument_engine(sync_engine, label):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        stats = request_stats.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.sql_time += elapsed
+            if SLOW_REQUEST_MS:
+                stats.queries.append((elapsed, statement))
+
+    pool = sync_engine.pool
+    if isinstance(pool, QueuePool):
+        POOL_CHECKED_OUT.labels(label).set_function(pool.checkedout)
+        POOL_SIZE.labels(label).set_function(pool.size)
+        POOL_OVERFLOW.labels(label).set_function(lambda: max(pool.overflow(), 0))
+
+instrument_engine(engine, "sync")
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine, "async")
+
+def record_request(request, status, started, stats):
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    REQUEST_LATENCY.labels(request.method, path, status).observe(elapsed)
+    SQL_STATEMENTS_PER_REQUEST.labels(request.method, path).observe(stats.statements)
+    SQL_TIME_PER_REQUEST.labels(request.method, path).observe(stats.sql_time)
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        print(f"🐢 Requête lente {request.method} {request.url.path} : {elapsed * 1000:.0f} ms, "
+              f"{stats.statements} requêtes SQL ({stats.sql_time * 1000:.0f} ms)")
+        for duration, statement in stats.queries:
+            print(f"    {duration * 1000:8.2f} ms  {' '.join(statement.split())[:500]}")
+
+async def observe_body(body, request, status, started, stats):
+    """La mesure se clôt une fois le corps envoyé (ou la connexion coupée)"""
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        record_request(request, status, started, stats)
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """Latence et SQL par requête. Les réponses en streaming (NDJSON) exécutent leurs requêtes pendant
+    l'itération du corps : elles sont comptées jusqu'à la fin de celui-ci, pas au retour de call_next."""
+    stats = RequestStats()
+    token = request_stats.set(stats)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except BaseException:
+        record_request(request, 500, started, stats)
+        raise
+    finally:
+        request_stats.reset(token)
+    response.body_iterator = observe_body(response.body_iterator, request, response.status_code, started, stats)
+    return response
+
+@app.get("/metrics")
+def get_metrics():
+    """Métriques au format texte Prometheus (propres à ce worker)"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# --- JOURNALISATION BUFFERISÉE (Audit & Mouvements de stock) ---
+AUDIT_BUFFER_ENABLED = os.getenv("AUDIT_BUFFER_ENABLED", "0") == "1"
+AUDIT_BUFFER_BATCH_SIZE = int(os.getenv("AUDIT_BUFFER_BATCH_SIZE", "500"))
+AUDIT_BUFFER_FLUSH_INTERVAL = float(os.getenv("AUDIT_BUFFER_FLUSH_INTERVAL", "1.0"))
+AUDIT_BUFFER_MAX_QUEUE = int(os.getenv("AUDIT_BUFFER_MAX_QUEUE", "100000"))
+# Attente maximale quand la file est pleine (secondes) : submit() tourne dans le hook after_commit,
+# parfois sur la boucle asyncio (mode async) ; au-delà, les lignes sont écrites directement
+AUDIT_BUFFER_PUT_TIMEOUT = float(os.getenv("AUDIT_BUFFER_PUT_TIMEOUT", "0.05"))
+STOCK_MOVEMENTS_BUFFERED = os.getenv("STOCK_MOVEMENTS_BUFFERED", "0") == "1"
+
+class BufferedWriter:
+    """File en mémoire vidée par lots (INSERT multi-lignes) dès que le lot est plein ou que le délai expire"""
+
+    def __init__(self, bind, batch_size, flush_interval, max_queue, put_timeout=0.05):
+        self.bind = bind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._counters_lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.overflow = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def submit(self, model, rows):
+        # File pleine : attente bornée (jamais indéfinie, l'appelant peut être la boucle asyncio),
+        # puis écriture directe du reste plutôt que de perdre des lignes
+        for i, row in enumerate(rows):
+            try:
+                self._queue.put((model, row), timeout=self.put_timeout)
+            except queue.Full:
+                self._write_overflow(model, rows[i:])
+                return
+
+    def _write_overflow(self, model, rows):
+        try:
+            with self.bind.begin() as conn:
+                conn.execute(insert(model), rows)
+            with self._counters_lock:
+                self.overflow += len(rows)
+                self.written += len(rows)
+        except Exception as e:
+            with self._counters_lock:
+                self.dropped += len(rows)
+            print(f"❌ {len(rows)} lignes de journal perdues (file pleine, écriture directe en échec : {e}).")
+
+    def stop(self, timeout=10):
+        """Arrêt propre : vide la file avant de rendre la main"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        rows_by_model = {}
+        for model, row in batch:
+            rows_by_model.setdefault(model, []).append(row)
+        for attempt in range(3):
+            try:
+                with self.bind.begin() as conn:
+                    for model, rows in rows_by_model.items():
+                        conn.execute(insert(model), rows)
+                with self._counters_lock:
+                    self.written += len(batch)
+                    self.batches += 1
+                return
+            except Exception as e:
+                print(f"⏳ Écriture du journal en échec ({e}), nouvelle tentative...")
+                time.sleep(0.5 * (attempt + 1))
+        with self._counters_lock:
+            self.dropped += len(batch)
+        print(f"❌ {len(batch)} lignes de journal perdues après 3 tentatives.")
+
+    def stats(self):
+        return {
+            "enabled": AUDIT_BUFFER_ENABLED,
+            "stock_movements_buffered": STOCK_MOVEMENTS_BUFFERED,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "overflow": self.overflow,
+        }
+
+audit_writer = BufferedWriter(engine, AUDIT_BUFFER_BATCH_SIZE, AUDIT_BUFFER_FLUSH_INTERVAL, AUDIT_BUFFER_MAX_QUEUE,
+                              AUDIT_BUFFER_PUT_TIMEOUT)
+
+def defer_write(db, model, rows):
+    """Met des lignes de côté : elles ne partent au writer que si la transaction est validée"""
+    db.info.setdefault("deferred_writes", []).append((model, rows))
+
+@event.listens_for(ERPSession, "after_commit")
+def _submit_deferred_writes(session):
+    for model, rows in session.info.pop("deferred_writes", ()):
+        audit_writer.submit(model, rows)
+
+@event.listens_for(ERPSession, "after_rollback")
+def _discard_deferred_writes(session):
+    session.info.pop("deferred_writes", None)
 
 # --- FONCTIONS UTILITAIRES ---
-def log_action(db, action, details, user_id=None):
-    db.add(AuditLog(action=action, details=details, user_id=user_id))
+def log_actions(db, records, strict=False):
+    """Journalise plusieurs actions. strict=True : écriture dans la transaction métier, tampon ou non"""
+    now = datetime.utcnow()
+    rows = [{"timestamp": now, **record} for record in records]
+    if not rows:
+        return
+    if AUDIT_BUFFER_ENABLED and not strict:
+        defer_write(db, AuditLog, rows)
+    else:
+        db.execute(insert(AuditLog), rows)
+
+def log_action(db, action, details, user_id=None, strict=False):
+    if AUDIT_BUFFER_ENABLED and not strict:
+        defer_write(db, AuditLog, [{"action": action, "details": details, "user_id": user_id, "timestamp": datetime.utcnow()}])
+    else:
+        db.add(AuditLog(action=action, details=details, user_id=user_id))
+
+def record_stock_movements(db, rows):
+    """Mouvements de stock : transactionnels par défaut (STOCK_MOVEMENTS_BUFFERED=1 pour les bufferiser)"""
+    now = datetime.utcnow()
+    rows = [{"timestamp": now, **row} for row in rows]
+    if AUDIT_BUFFER_ENABLED and STOCK_MOVEMENTS_BUFFERED:
+        defer_write(db, StockMovement, rows)
+    elif rows:
+        db.execute(insert(StockMovement), rows)
+
+# --- CACHE CATALOGUE (Produits & Attributs tarifaires clients) ---
+CATALOG_CACHE_ENABLED = os.getenv("CATALOG_CACHE_ENABLED", "1") == "1"
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "10000"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "60"))
+CATALOG_CHANNEL = "erp_catalog"
+
+# Instantanés immuables : on ne met jamais d'objets ORM (liés à une session) en cache
+ProductInfo = namedtuple("ProductInfo", ["id", "sku", "name", "price"])
+# current_debt n'y figure pas : il change à chaque validation et se lit toujours en base (over_credit_limit)
+ClientInfo = namedtuple("ClientInfo", ["id", "credit_limit", "is_vip"])
+
+class CatalogCache:
+    """Cache LRU borné avec expiration (TTL), partagé par les threads d'un worker.
+
+    Chaque chargement depuis la base relève l'époque d'invalidation avant sa lecture (begin_load) :
+    put_many écarte les clés invalidées (ou un clear) survenus depuis, dont la valeur lue est peut-être
+    déjà périmée. Les invalidations ne sont mémorisées que pendant qu'un chargement est en cours.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._cleared_at = 0
+        self._invalidated_at = {}
+        self._loading = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_drops = 0
+
+    def get_many(self, keys):
+        """Retourne (trouvés, manquants) pour une liste de clés"""
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is not None and entry[0] > now:
+                    self._data.move_to_end(key)
+                    found[key] = entry[1]
+                    self.hits += 1
+                else:
+                    if entry is not None:
+                        del self._data[key]
+                    missing.append(key)
+                    self.misses += 1
+        return found, missing
+
+    def begin_load(self):
+        """Début d'une lecture en base des clés manquantes ; retourne l'époque à passer à put_many"""
+        with self._lock:
+            self._loading += 1
+            return self._epoch
+
+    def end_load(self):
+        with self._lock:
+            self._loading -= 1
+            if not self._loading:
+                self._invalidated_at.clear()
+
+    def put_many(self, items, epoch=None):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            if epoch is not None:
+                fresh = {} if self._cleared_at > epoch else {
+                    key: value for key, value in items.items() if self._invalidated_at.get(key, 0) <= epoch}
+                self.stale_drops += len(items) - len(fresh)
+                items = fresh
+            for key, value in items.items():
+                self._data[key] = (expires_at, value)
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._epoch += 1
+            if self._loading:
+                self._invalidated_at[key] = self._epoch
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._cleared_at = self._epoch
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": CATALOG_CACHE_ENABLED,
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_drops": self.stale_drops,
+            }
+
+catalog_cache = CatalogCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+
+def _load_cached(db, kind, ids, loader):
+    keys = [(kind, i) for i in dict.fromkeys(ids)]
+    if not keys:
+        return {}
+    if not CATALOG_CACHE_ENABLED:
+        return loader(db, [k[1] for k in keys])
+    found, missing = catalog_cache.get_many(keys)
+    result = {key[1]: value for key, value in found.items()}
+    if missing:
+        epoch = catalog_cache.begin_load()
+        try:
+            loaded = loader(db, [k[1] for k in missing])
+            catalog_cache.put_many({(kind, i): v for i, v in loaded.items()}, epoch)
+        finally:
+            catalog_cache.end_load()
+        result.update(loaded)
+    return result
+
+def get_products(db, product_ids):
+    """Produits par id (cache puis une seule requête IN (...) pour les absents)"""
+    def loader(db, ids):
+        rows = db.query(Product.id, Product.sku, Product.name, Product.price).filter(Product.id.in_(ids))
+        return {r.id: ProductInfo(*r) for r in rows}
+    return _load_cached(db, "product", product_ids, loader)
+
+def get_clients(db, client_ids):
+    """Attributs tarifaires/crédit des clients par id (même stratégie que get_products)"""
+    def loader(db, ids):
+        rows = db.query(Client.id, Client.credit_limit, Client.is_vip).filter(Client.id.in_(ids))
+        return {r.id: ClientInfo(*r) for r in rows}
+    return _load_cached(db, "client", client_ids, loader)
+
+def over_credit_limit(db, client_ids):
+    """Ids des clients dont la dette dépasse la limite, lus dans la transaction courante (jamais en cache)"""
+    ids = set(client_ids)
+    if not ids:
+        return set()
+    rows = db.execute(select(Client.id).where(Client.id.in_(ids), Client.current_debt > Client.credit_limit))
+    return set(rows.scalars())
+
+def invalidate_catalog(db, *keys):
+    """Invalide des entrées du cache une fois la transaction courante validée.
+
+    Sous PostgreSQL, un NOTIFY est émis dans la même transaction : il n'est délivré
+    aux autres workers qu'au COMMIT (et jamais en cas de ROLLBACK).
+    """
+    db.info.setdefault("catalog_invalidations", set()).update(keys)
+    if db.get_bind().dialect.name == "postgresql":
+        for kind, key_id in keys:
+            db.execute(text("SELECT pg_notify(:channel, :payload)"),
+                       {"channel": CATALOG_CHANNEL, "payload": f"{kind}:{key_id}"})
+
+@event.listens_for(ERPSession, "after_commit")
+def _apply_catalog_invalidations(session):
+    for key in session.info.pop("catalog_invalidations", ()):
+        catalog_cache.invalidate(key)
+
+@event.listens_for(ERPSession, "after_rollback")
+def _discard_catalog_invalidations(session):
+    session.info.pop("catalog_invalidations", None)
+
+def listen_catalog_invalidations():
+    """Thread d'écoute LISTEN/NOTIFY : garde les caches des différents workers uvicorn cohérents"""
+    while True:
+        try:
+            raw = engine.raw_connection()
+            conn = raw.driver_connection
+            raw.detach()
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {CATALOG_CHANNEL}")
+            # Des notifications ont pu être perdues pendant la (re)connexion
+            catalog_cache.clear()
+            while True:
+                if select_fds([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    kind, _, key_id = conn.notifies.pop(0).payload.partition(":")
+                    catalog_cache.invalidate((kind, int(key_id)))
+        except Exception as e:
+            print(f"⏳ Écoute des invalidations du cache interrompue ({e}), reconnexion...")
+            catalog_cache.clear()
+            time.sleep(2)
 
 # --- DTOs ---
 class OrderItemDTO(BaseModel):
@@ -119,34 +699,37 @@ class OrderCreateDTO(BaseModel):
     items: list[OrderItemDTO]
     user_id: int
 
+class OrderValidateBatchDTO(BaseModel):
+    order_ids: list[int]
+    user_id: int
+
 # --- ENDPOINTS ---
 
-@app.post("/orders/")
-def create_order(order_data: OrderCreateDTO):
-    """Création d'une commande (Devis)"""
-    db = SessionLocal()
-    
+def create_order_tx(db, order_data):
     try:
         # 1. Vérifications Client
-        client = db.query(Client).filter(Client.id == order_data.client_id).first()
+        client = get_clients(db, [order_data.client_id]).get(order_data.client_id)
         if not client:
             raise HTTPException(404, "Client introuvable")
 
         # 2. Règle métier : Blocage si impayés > Limite de crédit
-        if client.current_debt > client.credit_limit:
-            log_action(db, "BLOCKED_ORDER", f"Client {client.id} a dépassé sa limite de crédit.", order_data.user_id)
+        if over_credit_limit(db, [client.id]):
+            log_action(db, "BLOCKED_ORDER", f"Client {client.id} a dépassé sa limite de crédit.", order_data.user_id, strict=True)
             db.commit()
             raise HTTPException(400, "Commande bloquée : Limite de crédit dépassée.")
 
+        products = get_products(db, [item.product_id for item in order_data.items])
+        for item_data in order_data.items:
+            if item_data.product_id not in products:
+                raise HTTPException(404, f"Produit {item_data.product_id} introuvable")
+
         new_order = Order(client_id=client.id, created_by_id=order_data.user_id)
         db.add(new_order)
         db.flush()
 
         total = 0.0
         for item_data in order_data.items:
-            product = db.query(Product).filter(Product.id == item_data.product_id).first()
-            if not product:
-                raise HTTPException(404, f"Produit {item_data.product_id} introuvable")
+            product = products[item_data.product_id]
             
             discount = 0.10 if client.is_vip else 0.0
             final_price = product.price * (1 - discount)
@@ -176,53 +759,300 @@ def create_order(order_data: OrderCreateDTO):
     except Exception as e:
         db.rollback()
         raise HTTPException(500, f"Erreur interne: {str(e)}")
-    finally:
-        db.close()
         
     # --- LE RETURN EST EN DEHORS DE LA BDD ---
     return {"status": "PENDING", "order_id": final_order_id, "total": final_total}
 
-@app.put("/orders/{order_id}/validate")
-def validate_order(order_id: int, user_id: int):
-    """Validation et sortie de stock"""
-    db = SessionLocal()
-    order = db.query(Order).filter(Order.id == order_id).first()
-    
+@app.post("/orders/")
+async def create_order(order_data: OrderCreateDTO):
+    """Création d'une commande (Devis)"""
+    return await run_db(create_order_tx, order_data)
+
+def create_orders_batch_tx(db, orders_data):
+    try:
+        # 1. Chargement ensembliste : cache puis une seule requête IN (...) pour les clients et une pour les produits
+        clients = get_clients(db, [o.client_id for o in orders_data])
+        products = get_products(db, [item.product_id for o in orders_data for item in o.items])
+        blocked = over_credit_limit(db, clients)
+
+        results = [None] * len(orders_data)
+        accepted = []
+        audit_rows = []
+
+        # 2. Application des règles métier en mémoire (mêmes règles que create_order)
+        for index, order_data in enumerate(orders_data):
+            client = clients.get(order_data.client_id)
+            if not client:
+                results[index] = {"index": index, "status": "REJECTED", "error": "Client introuvable"}
+                continue
+
+            if client.id in blocked:
+                log_action(db, "BLOCKED_ORDER", f"Client {client.id} a dépassé sa limite de crédit.", order_data.user_id, strict=True)
+                results[index] = {"index": index, "status": "REJECTED", "error": "Commande bloquée : Limite de crédit dépassée."}
+                continue
+
+            missing = [item.product_id for item in order_data.items if item.product_id not in products]
+            if missing:
+                results[index] = {"index": index, "status": "REJECTED", "error": f"Produit {missing[0]} introuvable"}
+                continue
+
+            discount = 0.10 if client.is_vip else 0.0
+            lines = []
+            total = 0.0
+            for item_data in order_data.items:
+                final_price = products[item_data.product_id].price * (1 - discount)
+                lines.append({"product_id": item_data.product_id, "quantity": item_data.quantity,
+                              "unit_price": final_price, "discount_applied": discount})
+                total += final_price * item_data.quantity
+
+            order = Order(client_id=client.id, created_by_id=order_data.user_id, total_amount=total)
+            accepted.append((index, order, lines, order_data.user_id))
+
+        # 3. Insertions en masse : un INSERT multi-lignes par table au lieu d'un flush par commande
+        if accepted:
+            db.add_all([order for _, order, _, _ in accepted])
+            db.flush()
+
+        item_rows = []
+        for index, order, lines, user_id in accepted:
+            item_rows.extend({**line, "order_id": order.id} for line in lines)
+            audit_rows.append({"action": "CREATE_ORDER", "details": f"Commande {order.id} créée", "user_id": user_id})
+            results[index] = {"index": index, "status": "PENDING", "order_id": order.id, "total": order.total_amount}
+
+        if item_rows:
+            db.execute(insert(OrderItem), item_rows)
+        log_actions(db, audit_rows)
+
+        db.commit()
+
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(500, f"Erreur interne: {str(e)}")
+
+    created = sum(1 for r in results if r["status"] == "PENDING")
+    return {"created": created, "rejected": len(results) - created, "results": results}
+
+@app.post("/orders/batch")
+async def create_orders_batch(orders_data: list[OrderCreateDTO]):
+    """Création en masse de commandes (imports EDI) : un résultat par commande"""
+    return await run_db(create_orders_batch_tx, orders_data)
+
+def validate_order_tx(db, order_id, user_id):
+    """Valide une commande dans sa propre transaction (lève HTTPException en cas de refus)"""
+    # 1. Chargement en une seule requête : commande + lignes + produits
+    order = (
+        db.query(Order)
+        .options(joinedload(Order.items).joinedload(OrderItem.product))
+        .filter(Order.id == order_id)
+        .first()
+    )
     if not order or order.status != "PENDING":
         raise HTTPException(400, "Commande invalide ou déjà traitée.")
 
-    # 1. Vérification des stocks pour chaque article
+    products = {item.product_id: item.product for item in order.items}
+    if None in products.values():
+        raise HTTPException(400, f"Produit introuvable dans la commande {order_id}.")
+
+    quantities = {}
     for item in order.items:
-        product = db.query(Product).filter(Product.id == item.product_id).first()
-        
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+    # 2. Passage PENDING -> VALIDATED atomique : deux validations concurrentes, une seule gagne
+    claimed = db.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == "PENDING")
+        .values(status="VALIDATED", validated_at=datetime.utcnow())
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if not claimed:
+        db.rollback()
+        raise HTTPException(400, "Commande invalide ou déjà traitée.")
+
+    # 3. Déduction atomique et conditionnelle des stocks, dans l'ordre des id produits (pas de deadlock)
+    for product_id in sorted(quantities):
+        product = products[product_id]
+        row = db.execute(
+            update(Product)
+            .where(Product.id == product_id, Product.stock_quantity >= quantities[product_id])
+            .values(stock_quantity=Product.stock_quantity - quantities[product_id])
+            .returning(Product.stock_quantity)
+            .execution_options(synchronize_session=False)
+        ).first()
+
         # Règle métier : Interdiction si stock insuffisant
-        if product.stock_quantity < item.quantity:
-            log_action(db, "STOCK_ERROR", f"Rupture sur produit {product.sku} lors commande {order_id}", user_id)
+        if row is None:
+            db.rollback()
+            log_action(db, "STOCK_ERROR", f"Rupture sur produit {product.sku} lors commande {order_id}", user_id, strict=True)
+            db.commit()
             raise HTTPException(400, f"Stock insuffisant pour le produit {product.name}")
 
-    # 2. Déduction des stocks et traçabilité
-    for item in order.items:
-        product = db.query(Product).filter(Product.id == item.product_id).first()
-        product.stock_quantity -= item.quantity
-        
-        # Mouvement de stock
-        db.add(StockMovement(product_id=product.id, quantity=item.quantity, movement_type="OUT", user_id=user_id))
-        
         # Alerte seuil de sécurité
-        if product.stock_quantity < product.safety_stock:
+        if row.stock_quantity < product.safety_stock:
             log_action(db, "ALERT_STOCK", f"Le produit {product.sku} est sous le seuil de sécurité !", user_id)
 
-    order.status = "VALIDATED"
-    
-    # Mise à jour dette client
-    client = db.query(Client).filter(Client.id == order.client_id).first()
-    client.current_debt += order.total_amount
+    # 4. Traçabilité des mouvements de stock
+    record_stock_movements(db, [
+        {"product_id": item.product_id, "quantity": item.quantity, "movement_type": "OUT", "user_id": user_id}
+        for item in order.items
+    ])
+
+    # Mise à jour dette client (incrément atomique, sans lecture préalable)
+    db.execute(
+        update(Client)
+        .where(Client.id == order.client_id)
+        .values(current_debt=Client.current_debt + order.total_amount)
+        .execution_options(synchronize_session=False)
+    )
 
     log_action(db, "VALIDATE_ORDER", f"Commande {order_id} validée et stock déduit.", user_id)
     db.commit()
-    db.close()
+
+def validate_orders_batch_tx(db, order_ids, user_id):
+    results = []
+    try:
+        for order_id in order_ids:
+            try:
+                validate_order_tx(db, order_id, user_id)
+                results.append({"order_id": order_id, "status": "VALIDATED"})
+            except HTTPException as e:
+                db.rollback()
+                results.append({"order_id": order_id, "status": "REJECTED", "error": e.detail})
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(500, f"Erreur interne: {str(e)}")
+
+    validated = sum(1 for r in results if r["status"] == "VALIDATED")
+    return {"validated": validated, "rejected": len(results) - validated, "results": results}
+
+def validate_single_order_tx(db, order_id, user_id):
+    try:
+        validate_order_tx(db, order_id, user_id)
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(500, f"Erreur interne: {str(e)}")
     return {"status": "VALIDATED", "msg": "Stocks mis à jour avec succès"}
 
+@app.put("/orders/validate")
+async def validate_orders_batch(batch: OrderValidateBatchDTO):
+    """Validation en masse : chaque commande est validée dans une transaction courte"""
+    return await run_db(validate_orders_batch_tx, batch.order_ids, batch.user_id)
+
+@app.put("/orders/{order_id}/validate")
+async def validate_order(order_id: int, user_id: int):
+    """Validation et sortie de stock"""
+    return await run_db(validate_single_order_tx, order_id, user_id)
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """Compteurs hit/miss du cache catalogue (propres à ce worker)"""
+    return catalog_cache.stats()
+
+@app.get("/audit/stats")
+def get_audit_stats():
+    """État du writer bufferisé du journal d'audit (propre à ce worker)"""
+    return audit_writer.stats()
+
+# --- LECTURE : PAGINATION PAR CURSEUR (KEYSET) & STREAMING NDJSON ---
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "2000"))
+
+def row_to_dict(row):
+    return {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in row._mapping.items()}
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor, sort_columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return [datetime.fromisoformat(v) if isinstance(col.type, DateTime) else v for col, v in zip(sort_columns, values)]
+    except Exception:
+        raise HTTPException(400, "Curseur de pagination invalide.")
+
+def stream_ndjson(stmt):
+    """Curseur côté serveur : les lignes partent par paquets, sans tout charger en mémoire.
+    Les lectures de paquets (FETCH) s'ajoutent au temps SQL de la requête, comme l'exécution initiale."""
+    stats = request_stats.get()
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE).execute(stmt)
+        partitions = result.partitions()
+        while True:
+            fetch_started = time.perf_counter()
+            partition = next(partitions, None)
+            if stats is not None:
+                stats.sql_time += time.perf_counter() - fetch_started
+            if partition is None:
+                return
+            yield "".join(json.dumps(row_to_dict(row)) + "\n" for row in partition)
+
+def list_keyset(stmt, sort_columns, limit, cursor, format):
+    """Pagination keyset : WHERE (tri) > (dernier vu) ORDER BY tri, sans OFFSET"""
+    if cursor:
+        stmt = stmt.where(tuple_(*sort_columns) > tuple_(*decode_cursor(cursor, sort_columns)))
+    stmt = stmt.order_by(*sort_columns)
+    if format == "ndjson":
+        return StreamingResponse(stream_ndjson(stmt), media_type="application/x-ndjson")
+
+    with engine.connect() as conn:
+        rows = conn.execute(stmt.limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], col.key) for col in sort_columns])
+    return {"items": [row_to_dict(r) for r in rows], "next_cursor": next_cursor}
+
+@app.get("/orders/")
+def list_orders(status: Optional[str] = None, client_id: Optional[int] = None,
+                date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                limit: int = Query(100, ge=1, le=1000), cursor: Optional[str] = None,
+                format: Literal["json", "ndjson"] = "json"):
+    """Commandes triées par date de création (index orders(status, created_at) et orders(client_id))"""
+    stmt = select(Order.id, Order.client_id, Order.total_amount, Order.status, Order.created_at, Order.created_by_id)
+    if status:
+        stmt = stmt.where(Order.status == status)
+    if client_id is not None:
+        stmt = stmt.where(Order.client_id == client_id)
+    if date_from:
+        stmt = stmt.where(Order.created_at >= date_from)
+    if date_to:
+        stmt = stmt.where(Order.created_at < date_to)
+    return list_keyset(stmt, [Order.created_at, Order.id], limit, cursor, format)
+
+@app.get("/order_items/")
+def list_order_items(order_id: Optional[int] = None, product_id: Optional[int] = None,
+                     limit: int = Query(100, ge=1, le=1000), cursor: Optional[str] = None,
+                     format: Literal["json", "ndjson"] = "json"):
+    """Lignes de commande triées par id"""
+    stmt = select(OrderItem.id, OrderItem.order_id, OrderItem.product_id, OrderItem.quantity,
+                  OrderItem.unit_price, OrderItem.discount_applied)
+    if order_id is not None:
+        stmt = stmt.where(OrderItem.order_id == order_id)
+    if product_id is not None:
+        stmt = stmt.where(OrderItem.product_id == product_id)
+    return list_keyset(stmt, [OrderItem.id], limit, cursor, format)
+
+@app.get("/stock_movements/")
+def list_stock_movements(product_id: Optional[int] = None, movement_type: Optional[str] = None,
+                         date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                         limit: int = Query(100, ge=1, le=1000), cursor: Optional[str] = None,
+                         format: Literal["json", "ndjson"] = "json"):
+    """Mouvements de stock triés par date (index stock_movements(product_id, timestamp))"""
+    stmt = select(StockMovement.id, StockMovement.product_id, StockMovement.quantity,
+                  StockMovement.movement_type, StockMovement.timestamp, StockMovement.user_id)
+    if product_id is not None:
+        stmt = stmt.where(StockMovement.product_id == product_id)
+    if movement_type:
+        stmt = stmt.where(StockMovement.movement_type == movement_type)
+    if date_from:
+        stmt = stmt.where(StockMovement.timestamp >= date_from)
+    if date_to:
+        stmt = stmt.where(StockMovement.timestamp < date_to)
+    return list_keyset(stmt, [StockMovement.timestamp, StockMovement.id], limit, cursor, format)
+
 @app.api_route("/seed/", methods=["GET", "POST"])
 def seed_data():
     """Génération du Master Data pour la démo"""
@@ -304,7 +1134,7 @@ def seed_massive_data():
             random_days_ago = random.randint(1, 90)
             past_date = datetime.utcnow() - timedelta(days=random_days_ago)
             
-            order = Order(client_id=c.id, created_by_id=admin.id, status="VALIDATED", created_at=past_date)
+            order = Order(client_id=c.id, created_by_id=admin.id, status="VALIDATED", created_at=past_date, validated_at=past_date)
             db.add(order)
             db.flush()
             
@@ -326,4 +1156,43 @@ def seed_massive_data():
         db.rollback()
         raise HTTPException(500, f"Erreur Seed Massive: {str(e)}")
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# --- GÉNÉRATEUR DE DONNÉES DE CHARGE ---
+generation_status = {"status": "En attente", "last_result": None}
+generation_lock = threading.Lock()
+
+def run_generation(params):
+    if not generation_lock.acquire(blocking=False):
+        return
+    try:
+        generation_status["status"] = "Génération en cours..."
+        def progress(msg):
+            generation_status["status"] = f"En cours : {msg}"
+        generation_status["last_result"] = generate_dataset(engine, progress=progress, **params)
+        generation_status["status"] = "Succès"
+        # Les instantanés en cache ne connaissent pas les nouvelles lignes chargées hors ORM
+        catalog_cache.clear()
+    except Exception as e:
+        print(f"❌ Erreur génération: {e}")
+        generation_status["status"] = f"Erreur: {str(e)}"
+    finally:
+        generation_lock.release()
+
+@app.post("/seed_generate/")
+def seed_generate(background_tasks: BackgroundTasks, clients: int = Query(10000, ge=1), products: int = Query(1000, ge=1),
+                  orders: int = Query(100000, ge=1), days: int = Query(730, ge=1), seed: int = 42,
+                  chunk_size: int = Query(50000, ge=1), end_date: date = DEFAULT_END_DATE,
+                  id_offset: Optional[int] = Query(None, ge=0)):
+    """Génère un jeu de données de charge (distributions saisonnières, chargement COPY) en arrière-plan"""
+    if generation_lock.locked():
+        raise HTTPException(409, "Une génération est déjà en cours.")
+    params = {"clients": clients, "products": products, "orders": orders, "days": days, "seed": seed, "chunk_size": chunk_size,
+              "end_date": end_date, "id_offset": id_offset}
+    background_tasks.add_task(run_generation, params)
+    return {"msg": "Génération lancée en arrière-plan.", "params": params}
+
+@app.get("/seed_generate/status")
+def seed_generate_status():
+    return generation_status
@@ -0,0 +1,59 @@
+"""Tests des règles de commande sur une base SQLite jetable : python -m pytest erp_service"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "erp_test.db")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture
+def api():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def test_validated_order_over_credit_limit_blocks_next_order(api):
+    with main.SessionLocal() as db:
+        user = main.User(username="vendeur_credit", role="SALES")
+        client = main.Client(name="Client Crédit", email="credit@test.com", phone="0600000001", credit_limit=100.0, current_debt=0.0)
+        product = main.Product(sku="SKU-CREDIT", name="Article", price=80.0, purchase_price=50.0, stock_quantity=100)
+        db.add_all([user, client, product])
+        db.commit()
+    order = {"client_id": client.id, "items": [{"product_id": product.id, "quantity": 2}], "user_id": user.id}
+
+    # La première commande est acceptée (dette 0) et met en cache les attributs du client
+    first = api.post("/orders/", json=order)
+    assert first.status_code == 200, first.text
+    validated = api.put(f"/orders/{first.json()['order_id']}/validate", params={"user_id": user.id})
+    assert validated.status_code == 200, validated.text
+
+    # Dette 160 > limite 100 : la commande suivante est bloquée malgré l'entrée client en cache
+    second = api.post("/orders/", json=order)
+    assert second.status_code == 400
+    assert "Limite de crédit" in second.json()["detail"]
+
+    batch = api.post("/orders/batch", json=[order])
+    assert batch.json()["results"][0]["status"] == "REJECTED"
+
+
+def test_debt_updated_elsewhere_blocks_order_despite_cached_client(api):
+    with main.SessionLocal() as db:
+        user = main.User(username="vendeur_autre_worker", role="SALES")
+        client = main.Client(name="Client Cache", email="cache@test.com", phone="0600000002", credit_limit=100.0, current_debt=0.0)
+        product = main.Product(sku="SKU-CACHE", name="Article", price=10.0, purchase_price=5.0, stock_quantity=100)
+        db.add_all([user, client, product])
+        db.commit()
+    order = {"client_id": client.id, "items": [{"product_id": product.id, "quantity": 1}], "user_id": user.id}
+    assert api.post("/orders/", json=order).status_code == 200
+
+    # Validation passée par un autre worker : aucune invalidation n'atteint le cache de celui-ci
+    with main.engine.begin() as conn:
+        conn.execute(main.update(main.Client).where(main.Client.id == client.id).values(current_debt=150.0))
+
+    assert api.post("/orders/", json=order).status_code == 400
+    assert api.post("/orders/batch", json=[order]).json()["results"][0]["status"] == "REJECTED"
@@ -0,0 +1,181 @@
+"""Banc d'essai de l'étape de transformation de l'ETL (sans base de données).
+
+Génère des DataFrames synthétiques au format de l'extraction (mêmes colonnes que EXTRACT_QUERY),
+de 10 000 à plusieurs dizaines de millions de lignes, puis mesure pour chaque étape de la
+transformation (dim_temps, dim_produit, dim_client, fact_ventes) le temps et le pic mémoire
+(tracemalloc, qui suit aussi les allocations numpy/pandas).
+
+La transformation d'origine (apply ligne à ligne, copies du DataFrame brut) est conservée ici
+comme référence : le bench échoue (code 1) si la version actuelle devient plus lente qu'elle.
+
+Usage :
+    python bench_transform.py --sizes 10000,100000,1000000
+    python bench_transform.py --sizes 50000000 --no-legacy --output bench_transform.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import etl  # noqa: E402
+
+
+def synthetic_extract(rows, seed=42, days=730):
+    """Lignes de commande synthétiques : ~2,5 lignes par commande, produits en loi de Zipf"""
+    rng = np.random.default_rng(seed)
+    orders = max(int(rows / 2.5), 1)
+    clients = max(rows // 25, 10)
+    products = max(rows // 100, 10)
+
+    order_id = np.sort(rng.integers(1, orders + 1, rows, dtype=np.int64))
+    order_client = rng.integers(1, clients + 1, orders + 1, dtype=np.int64)
+    order_created = (np.datetime64("2024-01-01T08:00:00")
+                     + rng.integers(0, days * 86400, orders + 1).astype("timedelta64[s]"))
+    order_validated = order_created + rng.integers(3600, 48 * 3600, orders + 1).astype("timedelta64[s]")
+    product_id = (rng.zipf(1.3, rows) - 1) % products + 1
+    price = np.round(rng.lognormal(np.log(80), 1.0, products + 1), 2)
+    vip = rng.random(clients + 1) < 0.08
+
+    client_id = order_client[order_id]
+    discount = np.where(vip[client_id], 0.10, 0.0)
+    product_names = np.array([f"Produit {i}" for i in range(products + 1)], dtype=object)
+    skus = np.array([f"SKU-{i:08d}" for i in range(products + 1)], dtype=object)
+    client_names = np.array([f"Client {i}" for i in range(clients + 1)], dtype=object)
+
+    return pd.DataFrame({
+        "order_id": order_id,
+        "date_commande": order_created[order_id],
+        "validated_at": order_validated[order_id],
+        "client_id": client_id,
+        "product_id": product_id,
+        "quantity": rng.integers(1, 10, rows),
+        "unit_price": np.round(price[product_id] * (1 - discount), 2),
+        "discount_applied": discount,
+        "sku": skus[product_id],
+        "product_name": product_names[product_id],
+        "purchase_price": np.round(price[product_id] * 0.7, 2),
+        "client_name": client_names[client_id],
+        "is_vip": vip[client_id],
+    })
+
+
+# --- RÉFÉRENCE : transformation d'origine (apply ligne à ligne, copies complètes) ---
+def legacy_dim_temps(df_raw):
+    df = df_raw.copy()
+    df['date_commande'] = pd.to_datetime(df['date_commande'])
+    dim_temps = pd.DataFrame({'date_key': df['date_commande'].dt.date.unique()})
+    dim_temps['date_key'] = pd.to_datetime(dim_temps['date_key'])
+    dim_temps['annee'] = dim_temps['date_key'].dt.year
+    dim_temps['mois'] = dim_temps['date_key'].dt.month
+    dim_temps['jour'] = dim_temps['date_key'].dt.day
+    dim_temps['saison'] = dim_temps['mois'].apply(etl.get_season)
+    return dim_temps
+
+
+def legacy_dim_produit(df_raw):
+    return df_raw[['product_id', 'sku', 'product_name', 'purchase_price']].drop_duplicates()
+
+
+def legacy_dim_client(df_raw):
+    dim_client = df_raw[['client_id', 'client_name', 'is_vip']].drop_duplicates().copy()
+    dim_client['segment'] = dim_client['is_vip'].apply(lambda x: 'VIP' if x else 'Standard')
+    dim_client['geographie'] = 'National'
+    return dim_client
+
+
+def legacy_fact_ventes(df_raw):
+    df = df_raw.copy()
+    df['date_commande'] = pd.to_datetime(df['date_commande'])
+    fact_ventes = df.copy()
+    fact_ventes['date_key'] = fact_ventes['date_commande'].dt.date
+    fact_ventes['montant_ht'] = fact_ventes['quantity'] * fact_ventes['unit_price']
+    fact_ventes['cout_total'] = fact_ventes['quantity'] * fact_ventes['purchase_price']
+    fact_ventes['marge'] = fact_ventes['montant_ht'] - fact_ventes['cout_total']
+    fact_ventes['magasin_id'] = 1
+    return fact_ventes[['order_id', 'date_key', 'client_id', 'product_id', 'magasin_id', 'quantity', 'montant_ht', 'marge']]
+
+
+IMPLEMENTATIONS = {
+    "legacy": {
+        "dim_temps": legacy_dim_temps,
+        "dim_produit": legacy_dim_produit,
+        "dim_client": legacy_dim_client,
+        "fact_ventes": legacy_fact_ventes,
+    },
+    "vectorized": {
+        "dim_temps": lambda df: etl.build_dim_temps(etl.order_dates(df)),
+        "dim_produit": lambda df: etl.build_dim_produit(df[['product_id', 'sku', 'product_name', 'purchase_price']]),
+        "dim_client": lambda df: etl.build_dim_client(df[['client_id', 'client_name', 'is_vip']]),
+        "fact_ventes": etl.build_fact_ventes,
+    },
+}
+
+
+def measure(fn, df_raw, track_memory):
+    """Durée (hors tracemalloc, qui ralentit les allocations) puis pic mémoire sur un second passage"""
+    started = time.perf_counter()
+    result = fn(df_raw)
+    duration = time.perf_counter() - started
+    output_mb = result.memory_usage(deep=True).sum() / 1e6
+    del result
+    peak_mb = None
+    if track_memory:
+        tracemalloc.start()
+        fn(df_raw)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return {"seconds": round(duration, 4), "peak_mb": round(peak_mb, 1) if peak_mb is not None else None,
+            "output_mb": round(output_mb, 1)}
+
+
+def run_benchmark(args):
+    implementations = ["vectorized"] if args.no_legacy else ["legacy", "vectorized"]
+    report = {"timestamp": datetime.utcnow().isoformat(), "params": {k: v for k, v in vars(args).items() if k != "output"},
+              "results": []}
+    for size in [int(s) for s in args.sizes.split(",")]:
+        df_raw = synthetic_extract(size, seed=args.seed)
+        input_mb = df_raw.memory_usage(deep=True).sum() / 1e6
+        print(f"🏁 {size:,} lignes ({input_mb:.0f} Mo en entrée)")
+        for name in implementations:
+            stages = {stage: measure(fn, df_raw, not args.no_memory) for stage, fn in IMPLEMENTATIONS[name].items()}
+            total = sum(s["seconds"] for s in stages.values())
+            report["results"].append({"rows": size, "implementation": name, "total_seconds": round(total, 4),
+                                      "rows_per_s": round(size / total) if total else None, "stages": stages})
+            detail = "  ".join(f"{stage}={m['seconds']}s/{m['peak_mb']}Mo" for stage, m in stages.items())
+            print(f"  {name:<10} total={total:.3f}s  {detail}")
+        del df_raw
+    return report
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Bench de l'étape de transformation de l'ETL")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Tailles séparées par des virgules (jusqu'à 50000000)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-legacy", action="store_true", help="Ne pas mesurer la transformation d'origine")
+    parser.add_argument("--no-memory", action="store_true", help="Ne pas mesurer le pic mémoire (plus rapide)")
+    parser.add_argument("--output", default="bench_transform.json")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Résultats écrits dans {args.output}")
+
+    # Verrou de non-régression : la version vectorisée doit rester plus rapide que la référence
+    totals = {(r["rows"], r["implementation"]): r["total_seconds"] for r in report["results"]}
+    regressions = [rows for (rows, impl), seconds in totals.items()
+                   if impl == "vectorized" and (rows, "legacy") in totals and seconds > totals[(rows, "legacy")]]
+    if regressions:
+        print(f"❌ Transformation vectorisée plus lente que la référence pour : {regressions}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,15 +1,43 @@
+import io
+import json
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, text
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from sqlalchemy import bindparam, create_engine, text
+from typing import Literal, Optional
 import os
+import queue
 import time
 import schedule
 import threading
-from fastapi import FastAPI, BackgroundTasks
+from datetime import date, datetime
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Query
 
 # --- CONFIGURATION ---
 SRC_URL = os.getenv("SRC_DB_URL", "postgresql://admin:password@db/erp_db")
 TGT_URL = os.getenv("TGT_DB_URL", "postgresql://admin:password@db/bi_warehouse")
 
+# Mode par défaut : "incremental" (watermark) ou "full" (reconstruction complète)
+ETL_MODE = os.getenv("ETL_MODE", "incremental")
+# Recouvrement relu à chaque run : couvre les validations commitées après le calcul du watermark
+ETL_OVERLAP_SECONDS = int(os.getenv("ETL_OVERLAP_SECONDS", "300"))
+# Intervalle entre deux runs planifiés (compté à partir de la fin du run précédent)
+ETL_INTERVAL_SECONDS = int(os.getenv("ETL_INTERVAL_SECONDS", "60"))
+WATERMARK_NAME = "fact_ventes"
+
+# Mode streaming : curseur serveur + pipeline extraction/transformation/chargement à mémoire bornée
+ETL_STREAMING = os.getenv("ETL_STREAMING", "0") == "1"
+ETL_CHUNK_SIZE = int(os.getenv("ETL_CHUNK_SIZE", "50000"))
+ETL_QUEUE_SIZE = int(os.getenv("ETL_QUEUE_SIZE", "2"))
+
+# Historique SCD2 des attributs suivis (is_vip, purchase_price) dans dim_client_hist / dim_produit_hist
+DIM_SCD2 = os.getenv("DIM_SCD2", "0") == "1"
+
+# Snapshot colonnaire (Parquet partitionné par mois) lu par l'analytics ; vide = désactivé
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "")
+
 app = FastAPI(
     title="ETL Manager (Distribution)",
     description="Extraction de l'ERP vers le Data Warehouse (Modèle en Étoile)",
@@ -19,7 +47,10 @@ app = FastAPI(
 etl_status = {
     "last_run": "Jamais",
     "status": "En attente",
-    "rows_loaded": 0
+    "rows_loaded": 0,
+    "mode": None,
+    "watermark": None,
+    "run_id": None
 }
 
 # --- FONCTION UTILITAIRE : SAISON ---
@@ -33,114 +64,1055 @@ def get_season(month):
     else:
         return "Automne"
 
+# --- EXTRACTION ---
+EXTRACT_QUERY = """
+SELECT 
+    o.id as order_id, o.created_at as date_commande, o.validated_at, o.client_id,
+    oi.product_id, oi.quantity, oi.unit_price, oi.discount_applied,
+    p.sku, p.name as product_name, p.purchase_price,
+    c.name as client_name, c.is_vip
+FROM orders o
+JOIN order_items oi ON o.id = oi.order_id
+JOIN products p ON oi.product_id = p.id
+JOIN clients c ON o.client_id = c.id
+WHERE o.status = 'VALIDATED'
+"""
+
+def build_extract_query(since=None, ordered=False, after_order_id=None):
+    query, params = EXTRACT_QUERY, {}
+    if since is not None and after_order_id is not None:
+        # Commandes insérées depuis le dernier chargement, même avec un validated_at ancien (seeders, reprises)
+        query += " AND (o.validated_at > %(since)s OR o.id > %(after_order_id)s)"
+        params.update(since=since, after_order_id=after_order_id)
+    elif since is not None:
+        query += " AND o.validated_at > %(since)s"
+        params["since"] = since
+    if ordered:
+        query += " ORDER BY o.id"
+    return query, params
+
+def extract(src_engine, since=None, after_order_id=None):
+    """Commandes validées ; en incrémental, seulement celles validées après `since` ou d'id > `after_order_id`"""
+    query, params = build_extract_query(since, after_order_id=after_order_id)
+    with src_engine.connect() as conn:
+        return pd.read_sql(query, conn, params=params)
+
+def extract_chunks(src_engine, since=None, chunk_size=ETL_CHUNK_SIZE, after_order_id=None):
+    """Même extraction, lue par blocs via un curseur côté serveur (triée par commande)"""
+    query, params = build_extract_query(since, ordered=True, after_order_id=after_order_id)
+    with src_engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=chunk_size)
+        yield from pd.read_sql(query, conn, params=params, chunksize=chunk_size)
+
+# --- TRANSFORMATION ---
+# Tables de correspondance : une indexation numpy au lieu d'un .apply() Python par ligne
+SAISONS = ["Hiver", "Printemps", "Été", "Automne"]
+SAISON_PAR_MOIS = np.array([SAISONS.index(get_season(m)) for m in range(1, 13)], dtype=np.int8)
+SEGMENTS = pd.CategoricalDtype(["Standard", "VIP"])
+
+def build_dim_temps(dates):
+    date_key = pd.DatetimeIndex(sorted(dates))
+    mois = date_key.month.to_numpy(dtype=np.int8)
+    return pd.DataFrame({
+        'date_key': date_key,
+        'annee': date_key.year.to_numpy(dtype=np.int16),
+        'mois': mois,
+        'jour': date_key.day.to_numpy(dtype=np.int8),
+        'saison': pd.Categorical.from_codes(SAISON_PAR_MOIS[mois - 1], categories=SAISONS),
+    })
+
+def build_dim_produit(produits):
+    return produits.drop_duplicates('product_id', keep='last').astype({'product_id': np.int32})
+
+def build_dim_client(clients):
+    clients = clients.drop_duplicates('client_id', keep='last')
+    # is_vip est nullable côté ERP : NULL = client standard (comme le mapping d'origine)
+    is_vip = clients['is_vip'].fillna(False).astype(bool)
+    return pd.DataFrame({
+        'client_id': clients['client_id'].to_numpy(dtype=np.int32),
+        'client_name': clients['client_name'].to_numpy(),
+        'is_vip': is_vip.to_numpy(),
+        'segment': pd.Categorical.from_codes(is_vip.to_numpy(dtype=np.int8), dtype=SEGMENTS),
+        # Ajout d'une géographie fictive pour respecter le CDC
+        'geographie': pd.Categorical.from_codes(np.zeros(len(clients), dtype=np.int8), categories=['National']),
+    })
+
+def build_dim_magasin():
+    # Comme l'ERP actuel n'a pas de multi-magasins, on crée une dimension par défaut
+    return pd.DataFrame({
+        'magasin_id': [1],
+        'nom_magasin': ['Boutique Centrale'],
+        'ville': ['Antananarivo']
+    })
+
+def build_fact_ventes(df_raw):
+    """Table de faits construite colonne par colonne (clés en int32), sans copie des lignes brutes"""
+    quantity = df_raw['quantity'].to_numpy(dtype=np.int32)
+    montant_ht = quantity * df_raw['unit_price'].to_numpy(dtype=np.float64)
+    cout_total = quantity * df_raw['purchase_price'].to_numpy(dtype=np.float64)
+    return pd.DataFrame({
+        'order_id': df_raw['order_id'].to_numpy(dtype=np.int32),
+        'date_key': pd.to_datetime(df_raw['date_commande']).dt.normalize(),
+        'client_id': df_raw['client_id'].to_numpy(dtype=np.int32),
+        'product_id': df_raw['product_id'].to_numpy(dtype=np.int32),
+        'magasin_id': np.ones(len(df_raw), dtype=np.int32), # Lien vers Dim_Magasin
+        'quantity': quantity,
+        'montant_ht': montant_ht,
+        'marge': montant_ht - cout_total,
+    })
+
+def order_dates(df_raw):
+    """Jours distincts de commande (pour dim_temps)"""
+    return pd.to_datetime(df_raw['date_commande']).dt.normalize().unique()
+
+def transform(df_raw):
+    """Construit dim_temps, dim_magasin et la table de faits à partir des lignes extraites
+    (dim_produit et dim_client sont synchronisées depuis leurs tables source, voir sync_dimensions)"""
+    return {
+        'dim_temps': build_dim_temps(order_dates(df_raw)),
+        'dim_magasin': build_dim_magasin(),
+        'fact_ventes': build_fact_ventes(df_raw),
+    }
+
+class DimensionAccumulator:
+    """Jours de commande et watermark collectés bloc après bloc (mémoire bornée par le nombre de jours)"""
+
+    def __init__(self):
+        self.dates = set()
+        self.watermark = None
+
+    def add(self, df_raw):
+        self.dates.update(order_dates(df_raw))
+        chunk_watermark = compute_watermark(df_raw)
+        self.watermark = chunk_watermark if self.watermark is None else max(self.watermark, chunk_watermark)
+
+    def tables(self):
+        return {
+            'dim_temps': build_dim_temps(self.dates),
+            'dim_magasin': build_dim_magasin(),
+        }
+
+def compute_watermark(df_raw):
+    """Plus haute date de validation extraite (date de commande pour l'historique sans validated_at)"""
+    validated_at = pd.to_datetime(df_raw['validated_at']).fillna(pd.to_datetime(df_raw['date_commande']))
+    return validated_at.max().to_pydatetime()
+
+# --- CHARGEMENT ---
+def to_records(df):
+    """Lignes en types Python natifs (psycopg2 ne sait pas adapter les scalaires numpy)"""
+    return df.astype(object).where(pd.notna(df), None).to_dict(orient="records")
+
+# Schéma explicite du Data Warehouse (plus de types devinés par pandas à chaque chargement)
+WAREHOUSE_TABLES = {
+    'dim_temps': [("date_key", "DATE"), ("annee", "INTEGER"), ("mois", "INTEGER"), ("jour", "INTEGER"), ("saison", "TEXT")],
+    'dim_produit': [("product_id", "INTEGER"), ("sku", "TEXT"), ("product_name", "TEXT"), ("purchase_price", "DOUBLE PRECISION")],
+    'dim_client': [("client_id", "INTEGER"), ("client_name", "TEXT"), ("is_vip", "BOOLEAN"), ("segment", "TEXT"), ("geographie", "TEXT")],
+    'dim_magasin': [("magasin_id", "INTEGER"), ("nom_magasin", "TEXT"), ("ville", "TEXT")],
+    'fact_ventes': [("order_id", "INTEGER"), ("date_key", "DATE"), ("client_id", "INTEGER"), ("product_id", "INTEGER"),
+                    ("magasin_id", "INTEGER"), ("quantity", "INTEGER"), ("montant_ht", "DOUBLE PRECISION"), ("marge", "DOUBLE PRECISION")],
+    # Marts : agrégats maintenus par l'ETL, lus directement par l'analytics
+    'mart_ventes_jour': [("date_key", "DATE"), ("montant_ht", "DOUBLE PRECISION"), ("marge", "DOUBLE PRECISION"),
+                         ("quantity", "BIGINT"), ("nb_commandes", "INTEGER"), ("nb_lignes", "INTEGER")],
+    'mart_produit_jour': [("product_id", "INTEGER"), ("date_key", "DATE"), ("quantity", "BIGINT"),
+                          ("montant_ht", "DOUBLE PRECISION"), ("marge", "DOUBLE PRECISION")],
+    'mart_client_rfm': [("client_id", "INTEGER"), ("last_order_date", "DATE"), ("frequence", "INTEGER"),
+                        ("montant_total", "DOUBLE PRECISION"), ("marge_totale", "DOUBLE PRECISION"),
+                        ("load_version", "BIGINT")],
+    'mart_segment_jour': [("segment", "TEXT"), ("date_key", "DATE"), ("montant_ht", "DOUBLE PRECISION"),
+                          ("marge", "DOUBLE PRECISION"), ("quantity", "BIGINT"), ("nb_commandes", "INTEGER")],
+    'mart_kpis': [("id", "INTEGER"), ("ca_total", "DOUBLE PRECISION"), ("marge_totale", "DOUBLE PRECISION"),
+                  ("nb_commandes", "BIGINT"), ("nb_lignes", "BIGINT"), ("updated_at", "TIMESTAMP")],
+}
+
+# Clés naturelles uniques (nécessaires aux upserts incrémentaux) : (nom, unique, colonnes)
+WAREHOUSE_INDEXES = {
+    'dim_temps': [("ux_dim_temps", True, "date_key")],
+    'dim_produit': [("ux_dim_produit", True, "product_id")],
+    'dim_client': [("ux_dim_client", True, "client_id")],
+    'dim_magasin': [("ux_dim_magasin", True, "magasin_id")],
+    'fact_ventes': [("ix_fact_ventes_order", False, "order_id"), ("ix_fact_ventes_date", False, "date_key"),
+                    ("ix_fact_ventes_client", False, "client_id")],
+    'mart_ventes_jour': [("ux_mart_ventes_jour", True, "date_key")],
+    'mart_produit_jour': [("ux_mart_produit_jour", True, "date_key, product_id")],
+    'mart_client_rfm': [("ux_mart_client_rfm", True, "client_id"), ("ix_mart_client_rfm_version", False, "load_version")],
+    'mart_segment_jour': [("ux_mart_segment_jour", True, "date_key, segment")],
+    'mart_kpis': [("ux_mart_kpis", True, "id")],
+}
+
+def create_index_sql(index, unique, table, columns, if_not_exists=False):
+    return f"CREATE {'UNIQUE ' if unique else ''}INDEX {'IF NOT EXISTS ' if if_not_exists else ''}{index} ON {table} ({columns})"
+
+def ensure_warehouse_keys(conn):
+    """Table de watermark, marts et index des tables publiées"""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS etl_watermark (
+            name VARCHAR PRIMARY KEY,
+            value TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+    """))
+    ensure_version_table(conn)
+    ensure_marts(conn)
+    for name, indexes in WAREHOUSE_INDEXES.items():
+        for index, unique, columns in indexes:
+            conn.execute(text(create_index_sql(index, unique, name, columns, if_not_exists=True)))
+
+def copy_frame(conn, table, df, name=None, columns=None):
+    """Chargement en masse via COPY FROM STDIN (CSV en mémoire), colonnes dans l'ordre du schéma"""
+    columns = columns or [col for col, _ in WAREHOUSE_TABLES[name or table]]
+    buffer = io.StringIO()
+    df[columns].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    with conn.connection.cursor() as cur:
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def create_table(conn, table, name):
+    columns = ", ".join(f"{col} {sqltype}" for col, sqltype in WAREHOUSE_TABLES[name])
+    conn.execute(text(f"CREATE TABLE {table} ({columns})"))
+
+def create_staging(conn, name):
+    """Table de staging vide, typée explicitement, invisible des lecteurs jusqu'à la bascule"""
+    staging = f"{name}_staging"
+    conn.execute(text(f"DROP TABLE IF EXISTS {staging}"))
+    create_table(conn, staging, name)
+    return staging
+
+def swap_staging(conn, names):
+    """Publie les tables de staging à la place des tables en service, dans la transaction courante.
+
+    Index et statistiques sont construits avant la bascule : les verrous exclusifs ne portent
+    que sur les DROP/RENAME, et les lecteurs voient soit l'ancienne version, soit la nouvelle.
+    Les verrous sont pris dans l'ordre de `names` (faits d'abord, comme les requêtes analytiques
+    qui partent de fact_ventes) pour ne pas créer d'interblocage avec les lecteurs.
+    """
+    for name in names:
+        staging = f"{name}_staging"
+        for index, unique, columns in WAREHOUSE_INDEXES[name]:
+            conn.execute(text(create_index_sql(f"{index}_staging", unique, staging, columns)))
+        conn.execute(text(f"ANALYZE {staging}"))
+    for name in names:
+        if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+            conn.execute(text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+    for name in names:
+        conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        conn.execute(text(f"ALTER TABLE {name}_staging RENAME TO {name}"))
+        for index, _, _ in WAREHOUSE_INDEXES[name]:
+            conn.execute(text(f"ALTER INDEX {index}_staging RENAME TO {index}"))
+
+# --- MARTS (agrégats pré-calculés) ---
+# Même requête pour la reconstruction complète (WHERE TRUE) et le recalcul des seules clés touchées
+MART_QUERIES = {
+    'mart_ventes_jour': """
+        SELECT date_key, SUM(montant_ht), SUM(marge), SUM(quantity), COUNT(DISTINCT order_id), COUNT(*)
+        FROM {facts} WHERE {where} GROUP BY date_key
+    """,
+    'mart_produit_jour': """
+        SELECT product_id, date_key, SUM(quantity), SUM(montant_ht), SUM(marge)
+        FROM {facts} WHERE {where} GROUP BY product_id, date_key
+    """,
+    # load_version : version du chargement qui a (re)calculé la ligne, pour le scoring RFM incrémental
+    'mart_client_rfm': """
+        SELECT client_id, MAX(date_key), COUNT(DISTINCT order_id), SUM(montant_ht), SUM(marge),
+               (SELECT COALESCE(MAX(version), 0) FROM warehouse_version)
+        FROM {facts} WHERE {where} GROUP BY client_id
+    """,
+    # Segment courant du client (dim_client) : les journées de ses ventes sont recalculées s'il en change
+    'mart_segment_jour': """
+        SELECT c.segment, f.date_key, SUM(f.montant_ht), SUM(f.marge), SUM(f.quantity), COUNT(DISTINCT f.order_id)
+        FROM {facts} f JOIN dim_client c ON c.client_id = f.client_id
+        WHERE {where} GROUP BY c.segment, f.date_key
+    """,
+}
+# Clé de recalcul incrémental de chaque mart
+MART_KEYS = {'mart_ventes_jour': 'date_key', 'mart_produit_jour': 'date_key', 'mart_client_rfm': 'client_id',
+             'mart_segment_jour': 'date_key'}
+MARTS = list(MART_QUERIES) + ['mart_kpis']
+
+def insert_mart(conn, name, target, facts, where="TRUE", params=None):
+    columns = ", ".join(col for col, _ in WAREHOUSE_TABLES[name])
+    statement = text(f"INSERT INTO {target} ({columns}) " + MART_QUERIES[name].format(facts=facts, where=where))
+    if params:
+        statement = statement.bindparams(bindparam("keys", expanding=True))
+    conn.execute(statement, params or {})
+
+def refresh_kpis(conn, target="mart_kpis", daily="mart_ventes_jour"):
+    """KPI globaux (une seule ligne) recalculés depuis le mart journalier, jamais depuis les faits"""
+    columns = ", ".join(col for col, _ in WAREHOUSE_TABLES['mart_kpis'])
+    conn.execute(text(f"DELETE FROM {target}"))
+    conn.execute(text(f"""
+        INSERT INTO {target} ({columns})
+        SELECT 1, COALESCE(SUM(montant_ht), 0), COALESCE(SUM(marge), 0),
+               COALESCE(SUM(nb_commandes), 0), COALESCE(SUM(nb_lignes), 0), now()
+        FROM {daily}
+    """))
+
+def build_marts_staging(conn):
+    """Reconstruction complète : marts calculés depuis fact_ventes_staging et publiés avec elle"""
+    for name in MART_QUERIES:
+        insert_mart(conn, name, create_staging(conn, name), "fact_ventes_staging")
+    refresh_kpis(conn, create_staging(conn, 'mart_kpis'), 'mart_ventes_jour_staging')
+    # Clients dont les agrégats n'ont pas bougé : version précédente conservée, pour que
+    # l'analytics ne re-score pas toute la base après chaque reconstruction complète
+    if conn.execute(text("SELECT to_regclass('mart_client_rfm')")).scalar():
+        conn.execute(text("ALTER TABLE mart_client_rfm ADD COLUMN IF NOT EXISTS load_version BIGINT"))
+        conn.execute(text("""
+            UPDATE mart_client_rfm_staging s SET load_version = m.load_version
+            FROM mart_client_rfm m
+            WHERE m.client_id = s.client_id AND m.last_order_date = s.last_order_date
+              AND m.frequence = s.frequence
+              -- Sommes flottantes : l'ordre d'agrégation varie d'un chargement à l'autre, comparaison au centime
+              AND abs(m.montant_total - s.montant_total) < 0.005 AND abs(m.marge_totale - s.marge_totale) < 0.005
+        """))
+
+def ensure_marts(conn):
+    """Marts absents (warehouse chargé avant leur introduction) : construits une fois depuis fact_ventes"""
+    if not conn.execute(text("SELECT to_regclass('fact_ventes')")).scalar():
+        return
+    for name in MARTS:
+        if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+            if name == 'mart_client_rfm':
+                conn.execute(text("ALTER TABLE mart_client_rfm ADD COLUMN IF NOT EXISTS load_version BIGINT"))
+            continue
+        create_table(conn, name, name)
+        if name == 'mart_kpis':
+            refresh_kpis(conn)
+        else:
+            insert_mart(conn, name, name, "fact_ventes")
+
+def new_affected_keys():
+    return {"date_key": set(), "client_id": set()}
+
+def track_affected(affected, rows):
+    for date_key, client_id in rows:
+        affected["date_key"].add(pd.Timestamp(date_key).date())
+        affected["client_id"].add(int(client_id))
+
+def refresh_mart(conn, name, keys):
+    key = MART_KEYS[name]
+    where = f"{key} IN :keys"
+    conn.execute(text(f"DELETE FROM {name} WHERE {where}").bindparams(bindparam("keys", expanding=True)), {"keys": keys})
+    insert_mart(conn, name, name, "fact_ventes", where, {"keys": keys})
+
+def refresh_marts(conn, affected):
+    """Incrémental : seules les journées et les clients touchés par le chargement sont recalculés"""
+    for name, key in MART_KEYS.items():
+        keys = sorted(affected[key])
+        if keys:
+            refresh_mart(conn, name, keys)
+    refresh_kpis(conn)
+
+def refresh_client_segments(conn, client_ids):
+    """Clients modifiés dans dim_client : leurs journées de vente sont recalculées dans mart_segment_jour"""
+    if not client_ids or not conn.execute(text("SELECT to_regclass('mart_segment_jour')")).scalar():
+        return
+    days = conn.execute(
+        text("SELECT DISTINCT date_key FROM fact_ventes WHERE client_id IN :ids").bindparams(bindparam("ids", expanding=True)),
+        {"ids": client_ids},
+    ).scalars().all()
+    if days:
+        refresh_mart(conn, 'mart_segment_jour', sorted(days))
+
+def read_watermark(tgt_engine):
+    """(plus haute date de validation chargée, plus haut order_id publié) ; None avant le premier run.
+
+    Le second terme, lu sur l'index de fact_ventes, rattrape les commandes insérées après le dernier
+    run avec un validated_at déjà passé (seeders, reprises de données), que la date seule ignorerait."""
+    with tgt_engine.connect() as conn:
+        exists = conn.execute(text("SELECT to_regclass('etl_watermark')")).scalar()
+        if not exists:
+            return None
+        value = conn.execute(text("SELECT value FROM etl_watermark WHERE name = :name"), {"name": WATERMARK_NAME}).scalar()
+        if value is None:
+            return None
+        return value, conn.execute(text("SELECT MAX(order_id) FROM fact_ventes")).scalar()
+
+def save_watermark(conn, value):
+    conn.execute(text("""
+        INSERT INTO etl_watermark (name, value, updated_at) VALUES (:name, :value, now())
+        ON CONFLICT (name) DO UPDATE SET value = GREATEST(etl_watermark.value, EXCLUDED.value), updated_at = now()
+    """), {"name": WATERMARK_NAME, "value": value})
+
+def ensure_version_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS warehouse_version (
+            id INTEGER PRIMARY KEY,
+            version BIGINT NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+    """))
+
+def bump_warehouse_version(conn):
+    """Version du Data Warehouse, incrémentée dans la transaction de chaque chargement :
+    l'analytics l'utilise pour invalider ses résultats en cache. Appelée avant le calcul des marts,
+    qui estampillent les lignes RFM recalculées avec la nouvelle version (visible au commit)"""
+    ensure_version_table(conn)
+    conn.execute(text("""
+        INSERT INTO warehouse_version (id, version, updated_at) VALUES (1, 1, now())
+        ON CONFLICT (id) DO UPDATE SET version = warehouse_version.version + 1, updated_at = now()
+    """))
+
+UPSERT_DIMENSIONS = {
+    'dim_temps': """
+        INSERT INTO dim_temps (date_key, annee, mois, jour, saison)
+        VALUES (:date_key, :annee, :mois, :jour, :saison)
+        ON CONFLICT (date_key) DO NOTHING
+    """,
+    'dim_magasin': """
+        INSERT INTO dim_magasin (magasin_id, nom_magasin, ville)
+        VALUES (:magasin_id, :nom_magasin, :ville)
+        ON CONFLICT (magasin_id) DO NOTHING
+    """,
+}
+
+# --- DIMENSIONS SYNCHRONISÉES DEPUIS LES TABLES SOURCE (hash par clé naturelle) ---
+# Tous les membres (même sans commande validée) ; seuls les membres dont le hash a changé sont relus et écrits
+DIMENSION_SOURCES = {
+    'dim_produit': {
+        'key': 'product_id',
+        'surrogate': 'produit_sk',
+        'source': "SELECT id AS product_id, sku, name AS product_name, purchase_price FROM products",
+        'attributes': ['sku', 'product_name', 'purchase_price'],
+        'history': ['purchase_price'],
+        'build': build_dim_produit,
+    },
+    'dim_client': {
+        'key': 'client_id',
+        'surrogate': 'client_sk',
+        'source': "SELECT id AS client_id, name AS client_name, is_vip FROM clients",
+        'attributes': ['client_name', 'is_vip'],
+        'history': ['is_vip'],
+        'build': build_dim_client,
+    },
+}
+# Au-delà de cette proportion de membres modifiés, la source est relue en entier plutôt que par listes d'ids
+DIMENSION_FULL_READ_RATIO = 0.3
+
+def ensure_dimension_table(conn, name, spec):
+    """Table de dimension avec clé de substitution entière (stable) et hash de ligne ; migre les anciennes tables"""
+    columns = ", ".join(f"{col} {sqltype}" for col, sqltype in WAREHOUSE_TABLES[name])
+    sk = spec['surrogate']
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} ({sk} INTEGER GENERATED BY DEFAULT AS IDENTITY, {columns})"))
+    conn.execute(text(f"ALTER TABLE {name} ADD COLUMN IF NOT EXISTS {sk} INTEGER GENERATED BY DEFAULT AS IDENTITY"))
+    conn.execute(text(f"ALTER TABLE {name} ADD COLUMN IF NOT EXISTS row_hash BIGINT"))
+    conn.execute(text(f"ALTER TABLE {name} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP"))
+    conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{name} ON {name} ({spec['key']})"))
+    conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{name}_sk ON {name} ({sk})"))
+    if DIM_SCD2:
+        seed = not conn.execute(text("SELECT to_regclass(:name)"), {"name": f"{name}_hist"}).scalar()
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {name}_hist (
+                version_sk INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                {columns},
+                row_hash BIGINT,
+                valid_from TIMESTAMP NOT NULL,
+                valid_to TIMESTAMP,
+                is_current BOOLEAN NOT NULL
+            )
+        """))
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{name}_hist_current ON {name}_hist ({spec['key']}) WHERE is_current"))
+        if seed:
+            # Historique activé sur une dimension déjà chargée : les valeurs actuelles deviennent la première
+            # version (depuis toujours), sinon le premier changement antidaterait la nouvelle valeur
+            column_list = ", ".join(col for col, _ in WAREHOUSE_TABLES[name])
+            conn.execute(text(f"""
+                INSERT INTO {name}_hist ({column_list}, row_hash, valid_from, valid_to, is_current)
+                SELECT {column_list}, row_hash, '-infinity'::timestamp, NULL, TRUE FROM {name}
+            """))
+
+def source_hashes(src_conn, spec):
+    """Hash 64 bits de chaque membre, calculé par PostgreSQL : seules deux colonnes quittent la source"""
+    attributes = ", ".join(spec['attributes'])
+    return pd.read_sql(text(f"""
+        SELECT {spec['key']}, ('x' || substr(md5(ROW({attributes})::text), 1, 16))::bit(64)::bigint AS row_hash
+        FROM ({spec['source']}) s
+    """), src_conn)
+
+def extract_dimension(src_conn, spec, keys, total):
+    query = f"SELECT * FROM ({spec['source']}) s"
+    if len(keys) > total * DIMENSION_FULL_READ_RATIO:
+        return pd.read_sql(text(query), src_conn)
+    statement = text(f"{query} WHERE {spec['key']} IN :keys").bindparams(bindparam("keys", expanding=True))
+    return pd.concat([pd.read_sql(statement, src_conn, params={"keys": keys[i:i + 10000]})
+                      for i in range(0, len(keys), 10000)], ignore_index=True)
+
+def apply_history(conn, name, spec, changes, now):
+    """SCD2 : clôt la version courante si un attribut suivi change, sinon la met à jour sur place"""
+    key, columns = spec['key'], [col for col, _ in WAREHOUSE_TABLES[name]]
+    tracked = ", ".join(f"h.{col}" for col in spec['history'])
+    tracked_new = ", ".join(f"c.{col}" for col in spec['history'])
+    conn.execute(text(f"""
+        UPDATE {name}_hist h SET valid_to = :now, is_current = FALSE
+        FROM {changes} c
+        WHERE h.{key} = c.{key} AND h.is_current AND ({tracked}) IS DISTINCT FROM ({tracked_new})
+    """), {"now": now})
+    conn.execute(text(f"""
+        UPDATE {name}_hist h SET {", ".join(f"{col} = c.{col}" for col in columns if col != key)}, row_hash = c.row_hash
+        FROM {changes} c
+        WHERE h.{key} = c.{key} AND h.is_current
+    """))
+    # Première version d'un membre : valable depuis toujours (les faits antérieurs au premier run s'y rattachent)
+    conn.execute(text(f"""
+        INSERT INTO {name}_hist ({", ".join(columns)}, row_hash, valid_from, valid_to, is_current)
+        SELECT {", ".join(f"c.{col}" for col in columns)}, c.row_hash,
+               CASE WHEN EXISTS (SELECT 1 FROM {name}_hist p WHERE p.{key} = c.{key})
+                    THEN CAST(:now AS TIMESTAMP) ELSE '-infinity'::timestamp END,
+               NULL, TRUE
+        FROM {changes} c
+        WHERE NOT EXISTS (SELECT 1 FROM {name}_hist h WHERE h.{key} = c.{key} AND h.is_current)
+    """), {"now": now})
+
+def sync_dimension(conn, src_conn, name, spec):
+    """Compare les hash source et warehouse, puis upsert des seuls membres nouveaux ou modifiés.
+    Retourne les clés des membres écrits."""
+    ensure_dimension_table(conn, name, spec)
+    key = spec['key']
+    incoming = source_hashes(src_conn, spec)
+    current = pd.read_sql(text(f"SELECT {key}, row_hash AS current_hash FROM {name}"), conn)
+    merged = incoming.merge(current, on=key, how='left')
+    changed = merged.loc[merged['current_hash'].isna() | (merged['current_hash'] != merged['row_hash']), [key, 'row_hash']]
+    if changed.empty:
+        return []
+
+    rows = extract_dimension(src_conn, spec, [int(k) for k in changed[key]], len(incoming))
+    dim = spec['build'](rows).merge(changed, on=key)
+    columns = [col for col, _ in WAREHOUSE_TABLES[name]]
+    changes = f"{name}_changes"
+    conn.execute(text(f"CREATE TEMP TABLE {changes} ({', '.join(f'{c} {t}' for c, t in WAREHOUSE_TABLES[name])}, "
+                      f"row_hash BIGINT) ON COMMIT DROP"))
+    copy_frame(conn, changes, dim, columns=columns + ['row_hash'])
+    conn.execute(text(f"""
+        INSERT INTO {name} ({", ".join(columns)}, row_hash, updated_at)
+        SELECT {", ".join(columns)}, row_hash, now() FROM {changes}
+        ON CONFLICT ({key}) DO UPDATE SET
+            {", ".join(f"{col} = EXCLUDED.{col}" for col in columns if col != key)},
+            row_hash = EXCLUDED.row_hash, updated_at = EXCLUDED.updated_at
+    """))
+    if DIM_SCD2:
+        apply_history(conn, name, spec, changes, datetime.utcnow())
+    conn.execute(text(f"DROP TABLE {changes}"))
+    return [int(k) for k in dim[key]]
+
+def sync_dimensions(conn, src_engine, refresh_segments=True):
+    """refresh_segments=False en reconstruction complète : les marts sont de toute façon recalculés"""
+    with src_engine.connect() as src_conn:
+        written = {name: sync_dimension(conn, src_conn, name, spec) for name, spec in DIMENSION_SOURCES.items()}
+    if any(written.values()):
+        bump_warehouse_version(conn)
+        print(f"🔁 Dimensions synchronisées : { {name: len(keys) for name, keys in written.items()} }")
+    if refresh_segments:
+        refresh_client_segments(conn, written['dim_client'])
+    return written
+
+# dim_temps et dim_magasin restent dérivées des faits ; les autres viennent de leurs tables source
+DERIVED_DIMENSIONS = ['dim_temps', 'dim_magasin']
+DIMENSIONS = ['dim_temps', 'dim_produit', 'dim_client', 'dim_magasin']
+
+def write_dimensions(conn, tables, mode, src_engine):
+    if mode == "full":
+        for name in DERIVED_DIMENSIONS:
+            copy_frame(conn, create_staging(conn, name), tables[name], name)
+    else:
+        for name, statement in UPSERT_DIMENSIONS.items():
+            conn.execute(text(statement), to_records(tables[name]))
+    sync_dimensions(conn, src_engine, refresh_segments=(mode != "full"))
+
+def write_facts(conn, fact_ventes, mode, first, keep_order_id=None, affected=None):
+    """Écrit un bloc de faits. En incrémental, les commandes relues sont remplacées, jamais dupliquées,
+    et les clés touchées (anciennes et nouvelles lignes) sont ajoutées à `affected` pour les marts"""
+    if mode == "full":
+        # Reconstruction : les faits vont en staging, publiés par swap_staging en fin de chargement
+        if first:
+            create_staging(conn, 'fact_ventes')
+        copy_frame(conn, 'fact_ventes_staging', fact_ventes, 'fact_ventes')
+        return
+    # keep_order_id : commande à cheval sur le bloc précédent, déjà purgée et partiellement rechargée
+    order_ids = [int(i) for i in fact_ventes['order_id'].unique() if i != keep_order_id]
+    if order_ids:
+        deleted = conn.execute(
+            text("DELETE FROM fact_ventes WHERE order_id IN :ids RETURNING date_key, client_id")
+            .bindparams(bindparam("ids", expanding=True)),
+            {"ids": order_ids},
+        )
+        track_affected(affected, deleted)
+    track_affected(affected, fact_ventes[['date_key', 'client_id']].drop_duplicates().itertuples(index=False))
+    copy_frame(conn, 'fact_ventes', fact_ventes)
+
+def load_full(src_engine, tgt_engine, tables, watermark):
+    """Reconstruction complète : COPY en staging puis bascule atomique de toutes les tables"""
+    with tgt_engine.begin() as conn:
+        write_dimensions(conn, tables, "full", src_engine)
+        write_facts(conn, tables['fact_ventes'], "full", first=True)
+        bump_warehouse_version(conn)
+        build_marts_staging(conn)
+        swap_staging(conn, ['fact_ventes'] + DERIVED_DIMENSIONS + MARTS)
+        ensure_warehouse_keys(conn)
+        save_watermark(conn, watermark)
+
+def load_incremental(src_engine, tgt_engine, tables, watermark):
+    """Ajout des nouveaux faits (idempotent sur order_id), upsert des seuls membres de dimension modifiés
+    et recalcul des marts sur les clés touchées"""
+    with tgt_engine.begin() as conn:
+        ensure_warehouse_keys(conn)
+        write_dimensions(conn, tables, "incremental", src_engine)
+        affected = new_affected_keys()
+        write_facts(conn, tables['fact_ventes'], "incremental", first=True, affected=affected)
+        bump_warehouse_version(conn)
+        refresh_marts(conn, affected)
+        save_watermark(conn, watermark)
+
+# --- SNAPSHOT PARQUET (lectures analytiques hors PostgreSQL) ---
+ARROW_TYPES = {
+    "INTEGER": pa.int32(), "BIGINT": pa.int64(), "DOUBLE PRECISION": pa.float64(), "DATE": pa.date32(),
+    "TEXT": pa.string(), "BOOLEAN": pa.bool_(), "TIMESTAMP": pa.timestamp("us"),
+}
+
+def arrow_schema(name):
+    return pa.schema([(col, ARROW_TYPES[sqltype]) for col, sqltype in WAREHOUSE_TABLES[name]])
+
+def export_arrow(conn, name, where="TRUE", params=None):
+    """COPY ... TO STDOUT lu par le parseur CSV natif d'Arrow : aucune ligne ne transite par Python"""
+    schema = arrow_schema(name)
+    buffer = io.BytesIO()
+    with conn.connection.cursor() as cur:
+        query = cur.mogrify(f"SELECT {', '.join(schema.names)} FROM {name} WHERE {where}", params).decode()
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", buffer)
+    if not buffer.tell():
+        return schema.empty_table()
+    buffer.seek(0)
+    return pa_csv.read_csv(
+        buffer,
+        read_options=pa_csv.ReadOptions(column_names=schema.names),
+        convert_options=pa_csv.ConvertOptions(column_types=schema, true_values=["t"], false_values=["f"],
+                                              strings_can_be_null=True),
+    )
+
+def write_parquet(table, snapshot_dir, relative_path):
+    path = os.path.join(snapshot_dir, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def read_manifest(snapshot_dir):
+    try:
+        with open(os.path.join(snapshot_dir, "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def month_bounds(month):
+    start = date(int(month[:4]), int(month[5:7]), 1)
+    end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+# Marts exportés en entier à chaque snapshot (une ligne par client ou par jour) : les agrégats RFM et
+# journaliers de l'analytics les lisent tels quels, sans regrouper les partitions de fact_ventes
+SNAPSHOT_MARTS = ['mart_client_rfm', 'mart_ventes_jour']
+
+def current_warehouse_version(conn):
+    ensure_version_table(conn)
+    return conn.execute(text("SELECT version FROM warehouse_version WHERE id = 1")).scalar()
+
+def snapshot_outdated(tgt_engine, snapshot_dir=SNAPSHOT_DIR):
+    """Vrai si le Data Warehouse a changé depuis le dernier manifeste (faits, dimensions seules,
+    ou snapshot précédent en échec) : le run réécrit alors le snapshot, même sans nouveaux faits"""
+    manifest = read_manifest(snapshot_dir)
+    with tgt_engine.begin() as conn:
+        version = current_warehouse_version(conn)
+    if version is None:
+        return False
+    return manifest is None or manifest.get("warehouse_version") != version
+
+def dimension_signature(conn, name):
+    """Nombre de membres et dernière écriture (updated_at, posé par sync_dimensions) ;
+    dim_temps et dim_magasin ne font qu'ajouter des lignes, leur nombre suffit"""
+    updated = "MAX(updated_at)::text" if name in DIMENSION_SOURCES else "NULL"
+    return list(conn.execute(text(f"SELECT COUNT(*), {updated} FROM {name}")).one())
+
+def write_snapshot(tgt_engine, snapshot_dir=SNAPSHOT_DIR):
+    """Exporte en Parquet les mois modifiés de fact_ventes, les dimensions et les marts, puis publie le manifeste.
+
+    Un mois n'est réexporté que si sa signature (lignes, quantités, montants lus dans le mart
+    journalier) diffère de celle du manifeste ; une dimension, si des membres ont été ajoutés ou
+    réécrits depuis (y compris par un run sans nouveaux faits). Les fichiers sont versionnés et le manifeste est
+    remplacé atomiquement en dernier : un lecteur voit toujours un snapshot complet. Les fichiers
+    remplacés sont supprimés au run suivant, une fois que plus aucun lecteur ne les référence.
+    Le manifeste porte la version du Data Warehouse exportée (lecture en REPEATABLE READ).
+    Retourne le nombre de mois réexportés et la liste des dimensions réexportées.
+    """
+    manifest = read_manifest(snapshot_dir) or {"version": 0, "partitions": {}, "dimensions": {}, "superseded": []}
+    for relative_path in manifest.get("superseded", []):
+        try:
+            os.remove(os.path.join(snapshot_dir, relative_path))
+        except FileNotFoundError:
+            pass
+    version = manifest["version"] + 1
+    partitions, dimensions, marts, superseded, exported, exported_dimensions = {}, {}, {}, [], 0, []
+
+    with tgt_engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+        warehouse_version = current_warehouse_version(conn)
+        signatures = conn.execute(text("""
+            SELECT to_char(date_key, 'YYYY-MM') AS month, SUM(nb_lignes), SUM(quantity),
+                   ROUND(SUM(montant_ht)::numeric, 2), ROUND(SUM(marge)::numeric, 2)
+            FROM mart_ventes_jour GROUP BY 1 ORDER BY 1
+        """)).all()
+        for month, *values in signatures:
+            signature = [int(values[0]), int(values[1]), float(values[2]), float(values[3])]
+            previous = manifest["partitions"].get(month)
+            if previous and previous["signature"] == signature:
+                partitions[month] = previous
+                continue
+            start, end = month_bounds(month)
+            table = export_arrow(conn, 'fact_ventes', "date_key >= %(start)s AND date_key < %(end)s",
+                                 {"start": start, "end": end})
+            relative_path = f"fact_ventes/month={month}/part-{version:06d}.parquet"
+            write_parquet(table, snapshot_dir, relative_path)
+            partitions[month] = {"file": relative_path, "rows": table.num_rows, "signature": signature}
+            exported += 1
+            if previous:
+                superseded.append(previous["file"])
+        superseded += [p["file"] for month, p in manifest["partitions"].items() if month not in partitions]
+
+        for name in DIMENSIONS:
+            signature = dimension_signature(conn, name)
+            previous = manifest["dimensions"].get(name)
+            if previous and previous.get("signature") == signature:
+                dimensions[name] = previous
+                continue
+            table = export_arrow(conn, name)
+            relative_path = f"{name}/part-{version:06d}.parquet"
+            write_parquet(table, snapshot_dir, relative_path)
+            dimensions[name] = {"file": relative_path, "rows": table.num_rows, "signature": signature}
+            exported_dimensions.append(name)
+            if previous:
+                superseded.append(previous["file"])
+
+        for name in SNAPSHOT_MARTS:
+            table = export_arrow(conn, name)
+            relative_path = f"{name}/part-{version:06d}.parquet"
+            write_parquet(table, snapshot_dir, relative_path)
+            marts[name] = {"file": relative_path, "rows": table.num_rows}
+            if name in manifest.get("marts", {}):
+                superseded.append(manifest["marts"][name]["file"])
+
+    new_manifest = {
+        "version": version,
+        "warehouse_version": warehouse_version,
+        "updated_at": datetime.utcnow().isoformat(),
+        "partitions": partitions,
+        "dimensions": dimensions,
+        "marts": marts,
+        "superseded": superseded,
+    }
+    manifest_path = os.path.join(snapshot_dir, "manifest.json")
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(new_manifest, f, indent=1)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return exported, exported_dimensions
+
+# --- PIPELINE STREAMING (extraction, transformation et chargement en parallèle) ---
+_END = object()
+
+def _put(q, item, stop):
+    """put bloquant qui abandonne si un autre étage a échoué (pas de thread coincé sur une file pleine)"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _END
+
+def run_streaming(src_engine, tgt_engine, mode, since, stats, after_order_id=None):
+    """Pipeline à files bornées : au plus ETL_QUEUE_SIZE blocs en attente entre deux étages.
+
+    Remplit `stats` (lignes et temps actif de chaque étage, les étages se chevauchant) et
+    retourne le watermark. Tout le chargement se fait dans une seule transaction : en cas
+    d'erreur d'un étage, le Data Warehouse reste dans son état précédent.
+    """
+    raw_queue = queue.Queue(maxsize=ETL_QUEUE_SIZE)
+    fact_queue = queue.Queue(maxsize=ETL_QUEUE_SIZE)
+    stop = threading.Event()
+    errors = []
+    dims = DimensionAccumulator()
+
+    def extractor():
+        try:
+            chunks = extract_chunks(src_engine, since, ETL_CHUNK_SIZE, after_order_id)
+            while True:
+                started = time.perf_counter()
+                chunk = next(chunks, None)
+                stats["extract_seconds"] += time.perf_counter() - started
+                if chunk is None or stop.is_set():
+                    return
+                stats["rows_extracted"] += len(chunk)
+                _put(raw_queue, chunk, stop)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(raw_queue, _END, stop)
+
+    def transformer():
+        try:
+            while (chunk := _get(raw_queue, stop)) is not _END:
+                started = time.perf_counter()
+                dims.add(chunk)
+                last_order_id = int(chunk['order_id'].iloc[-1])
+                fact_ventes = build_fact_ventes(chunk)
+                stats["transform_seconds"] += time.perf_counter() - started
+                _put(fact_queue, (fact_ventes, last_order_id), stop)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(fact_queue, _END, stop)
+
+    threads = [threading.Thread(target=extractor, daemon=True), threading.Thread(target=transformer, daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    count = 0
+    try:
+        with tgt_engine.begin() as conn:
+            if mode == "incremental":
+                ensure_warehouse_keys(conn)
+            previous_last_order = None
+            affected = new_affected_keys()
+            while (item := _get(fact_queue, stop)) is not _END:
+                started = time.perf_counter()
+                fact_ventes, last_order_id = item
+                write_facts(conn, fact_ventes, mode, first=(count == 0), keep_order_id=previous_last_order,
+                            affected=affected)
+                previous_last_order = last_order_id
+                count += len(fact_ventes)
+                etl_status["rows_loaded"] = count
+                stats["load_seconds"] += time.perf_counter() - started
+            if errors:
+                raise errors[0]
+            started = time.perf_counter()
+            if count:
+                tables = dims.tables()
+                stats["transform_seconds"] += time.perf_counter() - started
+                started = time.perf_counter()
+                write_dimensions(conn, tables, mode, src_engine)
+                bump_warehouse_version(conn)
+                if mode == "full":
+                    build_marts_staging(conn)
+                    swap_staging(conn, ['fact_ventes'] + DERIVED_DIMENSIONS + MARTS)
+                    ensure_warehouse_keys(conn)
+                else:
+                    refresh_marts(conn, affected)
+                save_watermark(conn, dims.watermark)
+        stats["load_seconds"] += time.perf_counter() - started
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    stats["rows_loaded"] = count
+    return dims.watermark
+
+# --- JOURNAL DES RUNS (persisté dans le Data Warehouse) ---
+ETL_RUNS_DDL = """
+CREATE TABLE IF NOT EXISTS etl_runs (
+    id SERIAL PRIMARY KEY,
+    mode VARCHAR NOT NULL,
+    trigger VARCHAR NOT NULL,
+    streaming BOOLEAN NOT NULL,
+    status VARCHAR NOT NULL,
+    started_at TIMESTAMP NOT NULL,
+    finished_at TIMESTAMP,
+    rows_extracted INTEGER,
+    rows_loaded INTEGER,
+    extract_seconds DOUBLE PRECISION,
+    transform_seconds DOUBLE PRECISION,
+    load_seconds DOUBLE PRECISION,
+    snapshot_seconds DOUBLE PRECISION,
+    total_seconds DOUBLE PRECISION,
+    rows_per_second DOUBLE PRECISION,
+    watermark TIMESTAMP,
+    error TEXT
+)
+"""
+
+def start_run(tgt_engine, run):
+    """Enregistre le début d'un run. Le journal ne doit jamais faire échouer l'ETL lui-même"""
+    try:
+        with tgt_engine.begin() as conn:
+            conn.execute(text(ETL_RUNS_DDL))
+            conn.execute(text("ALTER TABLE etl_runs ADD COLUMN IF NOT EXISTS snapshot_seconds DOUBLE PRECISION"))
+            return conn.execute(text("""
+                INSERT INTO etl_runs (mode, trigger, streaming, status, started_at)
+                VALUES (:mode, :trigger, :streaming, :status, :started_at) RETURNING id
+            """), run).scalar()
+    except Exception as e:
+        print(f"⚠️ Journal des runs indisponible : {e}")
+        return None
+
+def finish_run(tgt_engine, run_id, run):
+    if run_id is None:
+        return
+    try:
+        with tgt_engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE etl_runs SET
+                    mode = :mode, status = :status, finished_at = :finished_at,
+                    rows_extracted = :rows_extracted, rows_loaded = :rows_loaded,
+                    extract_seconds = :extract_seconds, transform_seconds = :transform_seconds,
+                    load_seconds = :load_seconds, snapshot_seconds = :snapshot_seconds, total_seconds = :total_seconds,
+                    rows_per_second = :rows_per_second, watermark = :watermark, error = :error
+                WHERE id = :id
+            """), {**run, "id": run_id})
+    except Exception as e:
+        print(f"⚠️ Journal des runs indisponible : {e}")
+
 # --- LOGIQUE MÉTIER ETL ---
-def run_etl_logic():
+src_engine = create_engine(SRC_URL, pool_pre_ping=True)
+tgt_engine = create_engine(TGT_URL, pool_pre_ping=True)
+
+# Single-flight : le scheduler et /trigger ne lancent jamais deux runs en parallèle
+etl_lock = threading.Lock()
+
+def run_etl_logic(mode=None, trigger="manual"):
+    """Lance un run ETL, sauf si un autre est déjà actif. Retourne l'id du run (None si ignoré)"""
+    if not etl_lock.acquire(blocking=False):
+        print("⏭️ Run ETL ignoré : un run est déjà en cours.")
+        return None
+    try:
+        return execute_run(mode or ETL_MODE, trigger)
+    finally:
+        etl_lock.release()
+
+def execute_run(mode, trigger):
     global etl_status
-    print("--- 🔄 Démarrage ETL (Star Schema) ---")
+    print(f"--- 🔄 Démarrage ETL (Star Schema, mode {mode}) ---")
     etl_status["status"] = "Extraction en cours..."
-    
-    try:
-        src_engine = create_engine(SRC_URL)
-        tgt_engine = create_engine(TGT_URL)
+    etl_status["mode"] = mode
 
+    run = {
+        "mode": mode, "trigger": trigger, "streaming": ETL_STREAMING, "status": "RUNNING",
+        "started_at": datetime.utcnow(), "finished_at": None, "rows_extracted": 0, "rows_loaded": 0,
+        "extract_seconds": 0.0, "transform_seconds": 0.0, "load_seconds": 0.0,
+        "snapshot_seconds": None, "total_seconds": None, "rows_per_second": None, "watermark": None, "error": None,
+    }
+    run_id = start_run(tgt_engine, run)
+    etl_status["run_id"] = run_id
+    started = time.perf_counter()
+
+    try:
         # ==========================================
         # 1. EXTRACTION (Depuis l'ERP)
         # ==========================================
-        query = """
-        SELECT 
-            o.id as order_id, o.created_at as date_commande, o.client_id,
-            oi.product_id, oi.quantity, oi.unit_price, oi.discount_applied,
-            p.sku, p.name as product_name, p.purchase_price,
-            c.name as client_name, c.is_vip
-        FROM orders o
-        JOIN order_items oi ON o.id = oi.order_id
-        JOIN products p ON oi.product_id = p.id
-        JOIN clients c ON o.client_id = c.id
-        WHERE o.status = 'VALIDATED'
-        """
-        with src_engine.connect() as conn:
-            df_raw = pd.read_sql(query, conn)
-        
-        if df_raw.empty:
-            print("Aucune commande validée à traiter.")
-            etl_status["status"] = "Terminé (Vide)"
-            return
+        since = after_order_id = None
+        if mode == "incremental":
+            stored = read_watermark(tgt_engine)
+            if stored is None:
+                print("Aucun watermark : premier chargement complet.")
+                mode = etl_status["mode"] = run["mode"] = "full"
+            else:
+                watermark, after_order_id = stored
+                since = watermark - pd.Timedelta(seconds=ETL_OVERLAP_SECONDS)
 
-        etl_status["status"] = "Transformation en cours..."
+        if ETL_STREAMING:
+            etl_status["status"] = "Pipeline streaming en cours..."
+            watermark = run_streaming(src_engine, tgt_engine, mode, since, run, after_order_id)
+        else:
+            step = time.perf_counter()
+            df_raw = extract(src_engine, since, after_order_id)
+            run["extract_seconds"] = time.perf_counter() - step
+            run["rows_extracted"] = len(df_raw)
 
-        # ==========================================
-        # 2. TRANSFORMATION (Création des Dimensions)
-        # ==========================================
-        
-        # --- Dim_Temps ---
-        df_raw['date_commande'] = pd.to_datetime(df_raw['date_commande'])
-        dim_temps = pd.DataFrame({'date_key': df_raw['date_commande'].dt.date.unique()})
-        dim_temps['date_key'] = pd.to_datetime(dim_temps['date_key'])
-        dim_temps['annee'] = dim_temps['date_key'].dt.year
-        dim_temps['mois'] = dim_temps['date_key'].dt.month
-        dim_temps['jour'] = dim_temps['date_key'].dt.day
-        dim_temps['saison'] = dim_temps['mois'].apply(get_season)
-
-        # --- Dim_Produit ---
-        dim_produit = df_raw[['product_id', 'sku', 'product_name', 'purchase_price']].drop_duplicates()
-
-        # --- Dim_Client ---
-        dim_client = df_raw[['client_id', 'client_name', 'is_vip']].drop_duplicates()
-        dim_client['segment'] = dim_client['is_vip'].apply(lambda x: 'VIP' if x else 'Standard')
-        # Ajout d'une géographie fictive pour respecter le CDC
-        dim_client['geographie'] = 'National'
+            if not df_raw.empty:
+                # ==========================================
+                # 2. TRANSFORMATION (Dimensions & Faits)
+                # ==========================================
+                etl_status["status"] = "Transformation en cours..."
+                step = time.perf_counter()
+                tables = transform(df_raw)
+                watermark = compute_watermark(df_raw)
+                run["transform_seconds"] = time.perf_counter() - step
 
-        # --- Dim_Magasin ---
-        # Comme l'ERP actuel n'a pas de multi-magasins, on crée une dimension par défaut
-        dim_magasin = pd.DataFrame({
-            'magasin_id': [1],
-            'nom_magasin': ['Boutique Centrale'],
-            'ville': ['Antananarivo']
-        })
+                # ==========================================
+                # 3. CHARGEMENT (Vers le Data Warehouse)
+                # ==========================================
+                etl_status["status"] = "Chargement en cours..."
+                step = time.perf_counter()
+                if mode == "full":
+                    load_full(src_engine, tgt_engine, tables, watermark)
+                else:
+                    load_incremental(src_engine, tgt_engine, tables, watermark)
+                run["load_seconds"] = time.perf_counter() - step
+                run["rows_loaded"] = len(tables['fact_ventes'])
 
-        # ==========================================
-        # 3. TRANSFORMATION (Création de la Table de Faits)
-        # ==========================================
-        fact_ventes = df_raw.copy()
-        
-        # Calcul des indicateurs (Mesures)
-        fact_ventes['date_key'] = fact_ventes['date_commande'].dt.date
-        fact_ventes['magasin_id'] = 1 # Lien vers Dim_Magasin
-        fact_ventes['montant_ht'] = fact_ventes['quantity'] * fact_ventes['unit_price']
-        fact_ventes['cout_total'] = fact_ventes['quantity'] * fact_ventes['purchase_price']
-        fact_ventes['marge'] = fact_ventes['montant_ht'] - fact_ventes['cout_total']
-
-        # Sélection finale des colonnes pour la table de faits
-        fact_ventes = fact_ventes[[
-            'order_id', 'date_key', 'client_id', 'product_id', 'magasin_id',
-            'quantity', 'montant_ht', 'marge'
-        ]]
-
-        etl_status["status"] = "Chargement en cours..."
+        count = run["rows_loaded"]
+        if not count:
+            # Pas de nouveaux faits : les produits et clients créés ou modifiés côté ERP sont tout de même propagés
+            with tgt_engine.begin() as conn:
+                if conn.execute(text("SELECT to_regclass('fact_ventes')")).scalar():
+                    # Marts ajoutés depuis le dernier chargement : créés sans attendre de nouvelles commandes
+                    ensure_warehouse_keys(conn)
+                sync_dimensions(conn, src_engine)
 
-        # ==========================================
-        # 4. CHARGEMENT (Vers le Data Warehouse)
-        # ==========================================
-        with tgt_engine.connect() as conn:
-            dim_temps.to_sql('dim_temps', conn, if_exists='replace', index=False)
-            dim_produit.to_sql('dim_produit', conn, if_exists='replace', index=False)
-            dim_client.to_sql('dim_client', conn, if_exists='replace', index=False)
-            dim_magasin.to_sql('dim_magasin', conn, if_exists='replace', index=False)
-            fact_ventes.to_sql('fact_ventes', conn, if_exists='replace', index=False)
-        
-        count = len(fact_ventes)
-        print(f"✅ ETL Terminé : {count} faits de ventes chargés.")
+        if SNAPSHOT_DIR and snapshot_outdated(tgt_engine):
+            # ==========================================
+            # 4. SNAPSHOT PARQUET (pour l'analytics)
+            # ==========================================
+            etl_status["status"] = "Snapshot Parquet en cours..."
+            step = time.perf_counter()
+            try:
+                months, dimensions = write_snapshot(tgt_engine)
+                print(f"🗂️ Snapshot Parquet : {months} mois réexportés, dimensions réexportées : {dimensions or 'aucune'}.")
+            except Exception as e:
+                # Le Data Warehouse est déjà à jour : le manifeste garde l'ancienne version, le
+                # snapshot est donc réécrit au prochain run, même sans nouvelle commande
+                print(f"⚠️ Snapshot Parquet en échec : {e}")
+                run["error"] = f"Snapshot: {e}"
+            run["snapshot_seconds"] = time.perf_counter() - step
+
+        if count:
+            print(f"✅ ETL Terminé ({mode}{', streaming' if ETL_STREAMING else ''}) : {count} faits de ventes chargés.")
+            run["watermark"] = watermark
+            etl_status["watermark"] = watermark.isoformat()
+            etl_status["status"] = "Succès"
+            run["status"] = "SUCCESS"
+        else:
+            print("Aucune commande validée à traiter.")
+            etl_status["status"] = "Terminé (Vide)"
+            run["status"] = "EMPTY"
         etl_status["rows_loaded"] = count
-        etl_status["status"] = "Succès"
         etl_status["last_run"] = time.strftime("%H:%M:%S")
-        
+
     except Exception as e:
         print(f"❌ Erreur ETL: {e}")
         etl_status["status"] = f"Erreur: {str(e)}"
+        run["status"] = "FAILED"
+        run["error"] = str(e)
+
+    finally:
+        run["finished_at"] = datetime.utcnow()
+        run["total_seconds"] = time.perf_counter() - started
+        run["rows_per_second"] = run["rows_loaded"] / run["total_seconds"] if run["total_seconds"] else None
+        finish_run(tgt_engine, run_id, run)
+    return run_id
 
 # --- SCHEDULER (Automatisation) ---
+def scheduled_run():
+    started = time.perf_counter()
+    run_etl_logic(trigger="schedule")
+    duration = time.perf_counter() - started
+    # schedule recalcule la prochaine échéance après la fin du job : un run plus long que
+    # l'intervalle décale le suivant au lieu d'en empiler plusieurs
+    if duration > ETL_INTERVAL_SECONDS:
+        print(f"⏳ Run de {duration:.0f}s > intervalle de {ETL_INTERVAL_SECONDS}s : prochain run différé.")
+
 def run_scheduler():
-    schedule.every(1).minutes.do(run_etl_logic)
+    schedule.every(ETL_INTERVAL_SECONDS).seconds.do(scheduled_run)
     while True:
         schedule.run_pending()
         time.sleep(1)
@@ -157,9 +1129,35 @@ def health_check():
 
 @app.get("/status")
 def get_status():
-    return etl_status
+    return {**etl_status, "running": etl_lock.locked()}
+
+@app.get("/runs")
+def list_runs(limit: int = Query(20, ge=1, le=500), status: Optional[str] = None):
+    """Historique des runs, du plus récent au plus ancien, avec la durée et le débit de chaque étape"""
+    query = "SELECT * FROM etl_runs"
+    params = {"limit": limit}
+    if status:
+        query += " WHERE status = :status"
+        params["status"] = status.upper()
+    query += " ORDER BY id DESC LIMIT :limit"
+    with tgt_engine.connect() as conn:
+        if not conn.execute(text("SELECT to_regclass('etl_runs')")).scalar():
+            return []
+        rows = conn.execute(text(query), params).mappings().all()
+
+    runs = []
+    for row in rows:
+        run = dict(row)
+        for stage, rows_key in (("extract", "rows_extracted"), ("transform", "rows_extracted"), ("load", "rows_loaded")):
+            seconds = run[f"{stage}_seconds"]
+            run[f"{stage}_rows_per_second"] = round(run[rows_key] / seconds, 1) if seconds and run[rows_key] else None
+        runs.append(run)
+    return runs
 
 @app.api_route("/trigger", methods=["GET", "POST"])
-def trigger_now(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_etl_logic)
-    return {"msg": "ETL lancé en arrière-plan vers le Data Warehouse !"}
\ No newline at end of file
+def trigger_now(background_tasks: BackgroundTasks, mode: Optional[Literal["incremental", "full"]] = None):
+    """mode=full force une reconstruction complète du Data Warehouse"""
+    if etl_lock.locked():
+        raise HTTPException(status_code=409, detail="Un run ETL est déjà en cours")
+    background_tasks.add_task(run_etl_logic, mode)
+    return {"msg": "ETL lancé en arrière-plan vers le Data Warehouse !", "mode": mode or ETL_MODE}
\ No newline at end of file
@@ -0,0 +1,27 @@
+"""Tests de la transformation de l'ETL (sans base de données) : python -m pytest etl_service"""
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import etl  # noqa: E402
+
+
+def test_build_dim_client_null_is_vip_is_standard():
+    # clients.is_vip est nullable dans l'ERP : une seule ligne NULL ne doit pas faire échouer chaque run
+    clients = pd.DataFrame({
+        "client_id": [1, 2, 3],
+        "client_name": ["Alpha", "Beta", "Gamma"],
+        "is_vip": pd.Series([True, None, False], dtype=object),
+    })
+    dim = etl.build_dim_client(clients)
+    assert dim["is_vip"].tolist() == [True, False, False]
+    assert dim["segment"].astype(str).tolist() == ["VIP", "Standard", "Standard"]
+
+
+def test_build_dim_client_keeps_last_duplicate():
+    clients = pd.DataFrame({"client_id": [7, 7], "client_name": ["Ancien", "Nouveau"], "is_vip": [False, True]})
+    dim = etl.build_dim_client(clients)
+    assert dim["client_name"].tolist() == ["Nouveau"]
+    assert dim["segment"].astype(str).tolist() == ["VIP"]